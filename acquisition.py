@@ -0,0 +1,407 @@
+from concurrent.futures import ThreadPoolExecutor
+from device import DeviceError, channel_label
+
+import metrics
+import numpy as np
+import queue
+import threading
+import time
+
+READ_SECONDS = metrics.histogram(
+    "tc08_read_seconds", "Time to poll the streaming buffers of all channels once"
+)
+BLOCK_LATENCY = metrics.histogram(
+    "tc08_block_latency_seconds", "Time from acquiring a block to consuming it"
+)
+CONSUME_SECONDS = metrics.histogram(
+    "tc08_consume_seconds", "Time to store, journal and check one drained batch"
+)
+SAMPLES = metrics.counter("tc08_samples_total", "Readings received per channel")
+MISSING = metrics.counter(
+    "tc08_missing_samples_total", "Readings missing from the stream per channel"
+)
+GAPS = metrics.counter("tc08_gaps_total", "Interruptions of the stream per channel")
+OVERFLOWS = metrics.counter(
+    "tc08_overflows_total", "Streaming buffer overflows reported per channel"
+)
+
+
+POLL_PERIOD = metrics.gauge("tc08_poll_period_seconds", "Current device polling period")
+CALLS = metrics.counter("tc08_device_calls_total", "USB round trips to the units")
+
+# streaming drains each channel's buffer with one call per channel, single
+# reads take every enabled channel in one call per interval, which needs fewer
+# round trips at slow intervals
+MODES = ("stream", "single")
+
+
+class PollScheduler:
+    # chooses how often to poll the device and how many readings to ask for
+    # per call from what the calls return: the period is as long as latency
+    # allows (fewest USB calls) while leaving headroom in the device buffer,
+    # halves after an overflow or a nearly full buffer and recovers gradually;
+    # the fill rate is measured against the host clock, not the nominal
+    # interval, so a slower device or a sped up simulator are followed too
+    HEADROOM = 0.5  # of the device buffer, poll before it is fuller than this
+    RECOVERY = 1.25  # period growth per call without pressure
+    MIN_PERIOD = 10  # ms
+    SMOOTHING = 0.2
+
+    def __init__(self, samp_int, buffer_len, max_period) -> None:
+        self.buffer_len = buffer_len
+        # at slow intervals a poll before the next reading is due is a wasted
+        # call, consumers are bounded by their own drain timer instead
+        self.max_period = max(max_period, samp_int)
+        self.interval = float(samp_int)  # host ms per reading, as measured
+        self.scale = 1.0
+        self.period = min(float(samp_int), self.max_period)
+
+    @property
+    def batch(self) -> int:
+        # readings expected per call with margin, a full batch is read again
+        expected = self.period / self.interval
+        return int(min(self.buffer_len, max(2 * expected + 1, 16)))
+
+    def update(self, counts, overflow, elapsed_ms) -> None:
+        # counts: readings per channel since the previous poll elapsed_ms ago
+        n = max(counts, default=0)
+        if n and elapsed_ms > 0:
+            self.interval += self.SMOOTHING * (elapsed_ms / n - self.interval)
+        pressure = n >= self.HEADROOM * self.buffer_len
+        if overflow or pressure:
+            self.scale = max(self.scale / 2, 1 / self.buffer_len)
+        else:
+            self.scale = min(self.scale * self.RECOVERY, 1.0)
+        target = min(self.max_period, self.HEADROOM * self.buffer_len * self.interval)
+        floor = max(min(self.interval, self.max_period), self.MIN_PERIOD)
+        self.period = max(target * self.scale, floor)
+        POLL_PERIOD.set(self.period / 1000)
+
+
+class AcquisitionWorker(threading.Thread):
+    # owns the device while logging, draining the TC-08 streaming buffer of
+    # every channel in batches and handing (time, temp) blocks to the GUI;
+    # readings are placed on the sampling grid by their device timestamps, so
+    # readings the device missed become NaN instead of being filled in. In
+    # single mode the host clock paces one get_single call per interval, a
+    # reading is placed in the interval it was taken in and intervals spanned
+    # entirely by an overrunning call are left NaN
+    BUFFER_LEN = 600
+    MAX_POLL_INT = 1000  # ms, bounds the latency of consumers and fast polling
+
+    def __init__(
+        self,
+        device,
+        channels,
+        tc_type,
+        samp_int,
+        unit=1,
+        mode="stream",
+        *args,
+        **kwargs,
+    ) -> None:
+        super().__init__(*args, daemon=True, **kwargs)
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}")
+        self.device = device
+        self.unit = unit
+        self.mode = mode
+        self.channels = list(channels)
+        self.labels = [channel_label((unit, ch)) for ch in self.channels]
+        self.tc_type = tc_type
+        self.samp_int = samp_int
+        self.blocks = queue.SimpleQueue()
+        self.error = None
+        self._stop_event = threading.Event()
+        self.scheduler = PollScheduler(samp_int, self.BUFFER_LEN, self.MAX_POLL_INT)
+        self.started = None  # host monotonic time the device started streaming
+        self._last_poll = None
+
+        # readings not handed over yet, by grid slot (device time / samp_int)
+        self._pending_slot = [np.empty(0, np.int64)] * len(self.channels)
+        self._pending_temp = [np.empty(0)] * len(self.channels)
+        self._seen = [None] * len(self.channels)  # latest slot per channel
+        self._next = None  # first slot not handed over
+        self._last_ms = [None] * len(self.channels)
+
+    @property
+    def poll_int(self) -> int:
+        # consumer cadence, the device itself is polled by the scheduler
+        return min(self.samp_int, self.MAX_POLL_INT)
+
+    def configure(self) -> int:
+        # called from the GUI thread before start so that errors surface there
+        return self.begin(self.prepare())
+
+    def prepare(self) -> int:
+        # enables the channels, returns the device's minimum interval for them
+        for ch in self.channels:
+            self.device.set_channel(ch, self.tc_type)
+        return self.device.get_minimum_interval_ms()
+
+    def begin(self, min_int) -> int:
+        # starts streaming (or the single read clock), slot 0 is the middle of
+        # the call
+        self.samp_int = max(self.samp_int, min_int)
+        t0 = time.monotonic()
+        if self.mode == "stream":
+            self.samp_int = self.device.run(self.samp_int)
+        self.started = (t0 + time.monotonic()) / 2
+        self.scheduler = PollScheduler(
+            self.samp_int, self.BUFFER_LEN, self.MAX_POLL_INT
+        )
+        return self.samp_int
+
+    def run(self) -> None:
+        try:
+            if self.mode == "single":
+                self.run_single()
+            else:
+                while not self._stop_event.wait(self.scheduler.period / 1000):
+                    self.read()
+                self.read()
+        except Exception as e:
+            self.error = e
+            print(f"Acquisition stopped: {e}")
+        finally:
+            self.device.stop()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+
+    def read(self) -> None:
+        t0 = time.perf_counter()
+        batch = self.scheduler.batch
+        counts, overflows = [], False
+        for i, ch in enumerate(self.channels):
+            temps, time_ms = [], []
+            # a full batch may leave readings behind in the device buffer, read
+            # again up to what the buffer can hold
+            for _ in range(-(-self.BUFFER_LEN // batch) + 1):
+                temp, t_ms, overflow = self.device.get_temp(ch, batch)
+                CALLS.inc(call="get_temp")
+                self.account(i, temp, t_ms, overflow)
+                temps.append(temp)
+                time_ms.append(t_ms)
+                overflows |= overflow
+                if len(temp) < batch:
+                    break
+            temp, time_ms = np.concatenate(temps), np.concatenate(time_ms)
+            counts.append(len(temp))
+            slot = np.rint(time_ms / self.samp_int).astype(np.int64)
+            self._pending_slot[i] = np.concatenate((self._pending_slot[i], slot))
+            self._pending_temp[i] = np.concatenate((self._pending_temp[i], temp))
+            if len(slot):
+                self._seen[i] = slot[-1]
+        if self._last_poll is not None:
+            elapsed_ms = (t0 - self._last_poll) * 1000
+            self.scheduler.update(counts, overflows, elapsed_ms)
+        self._last_poll = t0
+        self.hand_over()
+        READ_SECONDS.observe(time.perf_counter() - t0)
+
+    def run_single(self) -> None:
+        slot = 1
+        interval = self.samp_int / 1000
+        while not self._stop_event.wait(
+            max(self.started + slot * interval - time.monotonic(), 0)
+        ):
+            self.read_single(slot)
+            slot = max(slot + 1, int((time.monotonic() - self.started) / interval))
+
+    def read_single(self, slot) -> None:
+        # every enabled channel and the cold junction in one transaction
+        t0 = time.perf_counter()
+        temp, overflow = self.device.get_single()
+        CALLS.inc(call="get_single")
+        time_ms = np.array([slot * self.samp_int])
+        for i, ch in enumerate(self.channels):
+            self.account(i, temp[ch : ch + 1], time_ms, bool(overflow >> ch & 1))
+            self._pending_slot[i] = np.append(self._pending_slot[i], slot)
+            self._pending_temp[i] = np.append(self._pending_temp[i], temp[ch])
+            self._seen[i] = slot
+        self.hand_over()
+        READ_SECONDS.observe(time.perf_counter() - t0)
+
+    def hand_over(self) -> None:
+        # channels are read one after another, hand over the slots every
+        # channel has reported up to, unless one lags a whole device buffer
+        seen = [s for s in self._seen if s is not None]
+        if not seen:
+            return
+        if self._next is None:
+            self._next = min(int(s[0]) for s in self._pending_slot if len(s))
+        frontier = max(min(seen), max(seen) - self.BUFFER_LEN)
+        if len(seen) < len(self._seen):
+            frontier = max(seen) - self.BUFFER_LEN
+        if frontier < self._next:
+            return
+
+        k = frontier - self._next + 1
+        temp = np.full((len(self.channels), k), np.nan)
+        for i, slot in enumerate(self._pending_slot):
+            done = slot <= frontier
+            idx = slot[done] - self._next
+            valid = idx >= 0  # late duplicates of handed over slots
+            temp[i, idx[valid]] = self._pending_temp[i][done][valid]
+            self._pending_slot[i] = slot[~done]
+            self._pending_temp[i] = self._pending_temp[i][~done]
+        time_s = (self._next + np.arange(k)) * self.samp_int / 1000
+        self._next = frontier + 1
+        self.blocks.put((time_s, temp, time.time()))
+
+    def account(self, i, temp, time_ms, overflow) -> None:
+        # readings more than half an interval late count as missing
+        ch = self.labels[i]
+        SAMPLES.inc(len(temp), ch=ch)
+        OVERFLOWS.inc(int(overflow), ch=ch)
+        last = time_ms[:1] if self._last_ms[i] is None else self._last_ms[i]
+        missing = np.rint(np.diff(time_ms, prepend=last) / self.samp_int) - 1
+        GAPS.inc(int((missing > 0).sum()), ch=ch)
+        MISSING.inc(int(missing[missing > 0].sum() + np.isnan(temp).sum()), ch=ch)
+        if len(time_ms):
+            self._last_ms[i] = time_ms[-1]
+
+    def drain(self):
+        # all blocks acquired since the last call, merged into one (time, temp)
+        times, temps = [], []
+        while True:
+            try:
+                t, temp, acquired = self.blocks.get_nowait()
+            except queue.Empty:
+                break
+            BLOCK_LATENCY.observe(time.time() - acquired)
+            times.append(t)
+            temps.append(temp)
+        if not times:
+            return None, None
+        return np.concatenate(times), np.concatenate(temps, axis=1)
+
+
+class AcquisitionGroup:
+    # one AcquisitionWorker per unit, each polling on its own thread (the driver
+    # calls release the GIL, so units are read concurrently), merged into blocks
+    # on one session timeline: a unit's sampling grid is shifted by when it
+    # started streaming and its channels fill their rows of the merged block,
+    # NaN until it has reported the slots
+    def __init__(self, devices, channels, tc_type, samp_int, mode="stream") -> None:
+        # devices by unit, channels as sorted (unit, channel) ids
+        self.channels = list(channels)
+        self.samp_int = samp_int
+        self.mode = mode
+        units = sorted({unit for unit, _ in self.channels})
+        self.workers = [
+            AcquisitionWorker(
+                devices[unit],
+                [ch for u, ch in self.channels if u == unit],
+                tc_type,
+                samp_int,
+                unit,
+                mode,
+            )
+            for unit in units
+        ]
+        self.rows = []
+        row = 0
+        for worker in self.workers:
+            self.rows.append(slice(row, row + len(worker.channels)))
+            row += len(worker.channels)
+        self.offsets = [0] * len(self.workers)  # in slots
+        # per worker, first slot and the block not merged yet
+        self._first = [None] * len(self.workers)
+        self._pending = [None] * len(self.workers)
+        self._next = None  # first slot not handed over
+
+    @property
+    def poll_int(self) -> int:
+        return min(self.samp_int, AcquisitionWorker.MAX_POLL_INT)
+
+    @property
+    def error(self):
+        return next((w.error for w in self.workers if w.error), None)
+
+    def configure(self) -> int:
+        # all units at the slowest minimum interval, started together
+        with ThreadPoolExecutor(len(self.workers)) as pool:
+            min_int = max(pool.map(AcquisitionWorker.prepare, self.workers))
+            min_int = max(self.samp_int, min_int)
+            samp_ints = set(pool.map(lambda w: w.begin(min_int), self.workers))
+        if len(samp_ints) > 1:
+            raise DeviceError(f"units sample at different intervals {samp_ints}")
+        self.samp_int = samp_ints.pop()
+        first = min(w.started for w in self.workers)
+        self.offsets = [
+            int(np.rint((w.started - first) * 1000 / self.samp_int))
+            for w in self.workers
+        ]
+        return self.samp_int
+
+    def start(self) -> None:
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self) -> None:
+        for worker in self.workers:
+            worker._stop_event.set()
+        for worker in self.workers:
+            worker.stop()
+
+    def is_alive(self) -> bool:
+        return all(worker.is_alive() for worker in self.workers)
+
+    def read(self) -> None:
+        # polls every unit once from the calling thread, for manual clocking
+        for worker in self.workers:
+            worker.read()
+
+    def drain(self):
+        # the slots every unit has reported since the last call as one (time,
+        # temp) block, unless a unit lags a whole device buffer behind the rest
+        for i, worker in enumerate(self.workers):
+            time_block, temp_block = worker.drain()
+            if time_block is None:
+                continue
+            if self._pending[i] is None:
+                slot = int(np.rint(time_block[0] * 1000 / self.samp_int))
+                self._first[i] = slot + self.offsets[i]
+                self._pending[i] = temp_block
+            else:
+                self._pending[i] = np.concatenate(
+                    (self._pending[i], temp_block), axis=1
+                )
+
+        ends = [
+            first + pending.shape[1]
+            for first, pending in zip(self._first, self._pending)
+            if pending is not None
+        ]
+        if not ends:
+            return None, None
+        frontier = max(ends) - AcquisitionWorker.BUFFER_LEN
+        if len(ends) == len(self.workers):
+            frontier = max(min(ends), frontier)
+        start = self._next
+        if start is None:
+            start = min(f for f in self._first if f is not None)
+        if frontier <= start:
+            return None, None
+
+        k = frontier - start
+        temp = np.full((len(self.channels), k), np.nan)
+        for i, rows in enumerate(self.rows):
+            pending = self._pending[i]
+            if pending is None:
+                continue
+            first = self._first[i]
+            # late slots of a lagging unit were handed over as NaN already
+            lo, hi = max(first, start), min(first + pending.shape[1], frontier)
+            if hi > lo:
+                block = pending[:, lo - first : hi - first]
+                temp[rows, lo - start : hi - start] = block
+            keep = min(max(frontier - first, 0), pending.shape[1])
+            self._pending[i] = pending[:, keep:]
+            self._first[i] = first + keep
+        self._next = frontier
+        return (start + np.arange(k)) * self.samp_int / 1000, temp
@@ -0,0 +1,221 @@
+from session import SessionWriter, read_csv
+from store import SampleStore
+
+import numpy as np
+
+# bucket lengths in s by the name used in the aggregate file suffixes
+RESOLUTIONS = {"1min": 60, "1h": 3600}
+FIELDS = ("n", "min", "mean", "max", "std")
+# s per pixel from which plots show bucket envelopes instead of raw ones
+LONG_VIEW = 60
+CHUNK = 1 << 16  # samples per pass, bounds the temporaries of a long load
+
+
+def aggregate_path(stem, name) -> str:
+    return f"{stem}.{name}.csv"
+
+
+def accumulate(time, temp, resolution):
+    # bucket indices and (n, sum, sum of squares, min, max) of each bucket
+    # present in a time ordered block, (5, n_ch, m); gaps (NaN) are not counted
+    idx = np.floor(time / resolution).astype(np.int64)
+    starts = np.flatnonzero(np.diff(idx, prepend=idx[0] - 1))
+    valid = ~np.isnan(temp)
+    x = np.where(valid, temp, 0.0)
+    acc = np.stack(
+        [
+            np.add.reduceat(valid, starts, axis=1),
+            np.add.reduceat(x, starts, axis=1),
+            np.add.reduceat(x * x, starts, axis=1),
+            np.minimum.reduceat(np.where(valid, temp, np.inf), starts, axis=1),
+            np.maximum.reduceat(np.where(valid, temp, -np.inf), starts, axis=1),
+        ]
+    )
+    return idx[starts], acc
+
+
+def merge(a, b):
+    # accumulators of the samples of two buckets together
+    return np.concatenate(
+        (a[:3] + b[:3], np.minimum(a[3:4], b[3:4]), np.maximum(a[4:], b[4:]))
+    )
+
+
+def statistics(acc):
+    # FIELDS from accumulators, (5, ...) each, NaN for buckets without samples
+    n, total, squares, lo, hi = acc
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / n
+        std = np.sqrt(np.maximum(squares / n - mean * mean, 0))
+    empty = n == 0
+    return np.stack(
+        [n, np.where(empty, np.nan, lo), mean, np.where(empty, np.nan, hi), std]
+    )
+
+
+class Level:
+    # closed buckets of one resolution as a SampleStore of the FIELDS stacked
+    # by field in float32, plus the float64 accumulators of the open bucket
+    def __init__(self, resolution, n_ch) -> None:
+        self.resolution = resolution
+        self.n_ch = n_ch
+        self.buckets = SampleStore(len(FIELDS) * n_ch, 64, np.float32)
+        self.open = None  # index of the open bucket
+        self.acc = None
+
+    def field(self, name) -> np.ndarray:
+        i = FIELDS.index(name)
+        return self.buckets.temp[i * self.n_ch : (i + 1) * self.n_ch]
+
+    def update(self, time, temp):
+        # (start time, FIELDS) of the buckets the block closed, None if none
+        ids, acc = accumulate(time, temp, self.resolution)
+        if self.open == ids[0]:
+            acc[:, :, 0] = merge(self.acc, acc[:, :, 0])
+        elif self.open is not None:
+            ids = np.concatenate(([self.open], ids))
+            acc = np.concatenate((self.acc[:, :, None], acc), axis=2)
+        self.open, self.acc = ids[-1], acc[:, :, -1]
+        return self.close(ids[:-1], acc[:, :, :-1])
+
+    def flush(self):
+        # closes the open bucket, e.g. at the end of a session
+        if self.open is None:
+            return None
+        closed = self.close([self.open], self.acc[:, :, None])
+        self.open = self.acc = None
+        return closed
+
+    def close(self, ids, acc):
+        if not len(ids):
+            return None
+        time = np.asarray(ids, dtype=float) * self.resolution
+        stats = statistics(acc).reshape(len(FIELDS) * self.n_ch, -1)
+        self.buckets.append(time, stats)
+        return time, stats
+
+    def restore(self, path) -> float:
+        # closed buckets from an aggregate file, returns the end of the last
+        # one (-inf if the file is missing or does not match) so that only
+        # later samples need to be aggregated
+        try:
+            _, columns, time, stats = read_csv(path)
+        except (OSError, ValueError):
+            return -np.inf
+        if len(columns) != len(FIELDS) * self.n_ch or not len(time):
+            return -np.inf
+        # columns grouped by channel in the file
+        stats = stats.reshape(self.n_ch, len(FIELDS), -1).transpose(1, 0, 2)
+        self.buckets.append(time, stats.reshape(-1, len(time)))
+        return time[-1] + self.resolution
+
+    def total(self):
+        # FIELDS over all samples so far, (5, n_ch)
+        n, mean, std = (self.field(name).astype(float) for name in ("n", "mean", "std"))
+        acc = np.stack(
+            [
+                n.sum(axis=1),
+                np.nansum(n * mean, axis=1),
+                np.nansum(n * (std * std + mean * mean), axis=1),
+                np.fmin.reduce(self.field("min"), axis=1, initial=np.inf),
+                np.fmax.reduce(self.field("max"), axis=1, initial=-np.inf),
+            ]
+        )
+        if self.open is not None:
+            acc = merge(acc, self.acc)
+        return statistics(acc)
+
+
+class Aggregates:
+    # per-channel n/min/mean/max/std of the samples in fixed time buckets at
+    # several resolutions, updated block by block in O(1) per sample; given a
+    # session stem, closed buckets are journaled to one CSV file per resolution
+    # next to the session
+    def __init__(
+        self, n_ch, stem=None, header=(), ch_names=(), resolutions=RESOLUTIONS
+    ) -> None:
+        self.n_ch = n_ch
+        self.levels = {name: Level(r, n_ch) for name, r in resolutions.items()}
+        self.writers = {}
+        if stem:
+            columns = [f"{ch} {field}" for ch in ch_names for field in FIELDS]
+            for name in self.levels:
+                path = aggregate_path(stem, name)
+                self.writers[name] = SessionWriter(path, header, columns)
+
+    def update(self, time, temp) -> None:
+        for i in range(0, len(time), CHUNK):
+            time_block, temp_block = time[i : i + CHUNK], temp[:, i : i + CHUNK]
+            for name, level in self.levels.items():
+                self.write(name, level.update(time_block, temp_block))
+
+    @classmethod
+    def restore(cls, stem, time, temp, resolutions=RESOLUTIONS) -> "Aggregates":
+        # of a loaded session, from the aggregate files saved next to it at
+        # stem where they exist and from the samples they do not cover yet
+        aggregates = cls(len(temp), resolutions=resolutions)
+        for name, level in aggregates.levels.items():
+            end = level.restore(aggregate_path(stem, name)) if stem else -np.inf
+            i = np.searchsorted(time, end, side="left")
+            for j in range(i, len(time), CHUNK):
+                level.update(time[j : j + CHUNK], temp[:, j : j + CHUNK])
+        return aggregates
+
+    def write(self, name, closed) -> None:
+        if closed and name in self.writers:
+            time, stats = closed
+            # columns grouped by channel in the file
+            stats = stats.reshape(len(FIELDS), self.n_ch, -1).transpose(1, 0, 2)
+            self.writers[name].write(time, stats.reshape(-1, len(time)))
+
+    def close(self) -> None:
+        # the last, partial buckets are written too
+        for name, level in self.levels.items():
+            self.write(name, level.flush())
+        for writer in self.writers.values():
+            writer.close()
+
+    def view(self, x0, x1, width):
+        # (time, temp) of the min/max envelope of the coarsest level with at
+        # least a bucket per pixel to draw [x0, x1] as trends, a (min, max) pair
+        # per bucket like MinMaxPyramid.view; None for views shorter than
+        # LONG_VIEW per pixel
+        per_px = (x1 - x0) / width
+        levels = [
+            level
+            for level in self.levels.values()
+            if LONG_VIEW <= level.resolution <= per_px
+        ]
+        if not levels:
+            return None
+        level = max(levels, key=lambda level: level.resolution)
+        r = level.resolution
+        time = level.buckets.time
+        lo = np.searchsorted(time, x0 - r, side="left")
+        hi = np.searchsorted(time, x1, side="right")
+        time = time[lo:hi]
+        lows, highs = level.field("min")[:, lo:hi], level.field("max")[:, lo:hi]
+        if level.open is not None and level.open * r <= x1:
+            stats = statistics(level.acc)
+            time = np.append(time, level.open * r)
+            lows = np.concatenate((lows, stats[1][:, None]), axis=1)
+            highs = np.concatenate((highs, stats[3][:, None]), axis=1)
+        y = np.empty((self.n_ch, 2 * len(time)), dtype=lows.dtype)
+        y[:, 0::2] = lows
+        y[:, 1::2] = highs
+        return np.repeat(time, 2), y
+
+    def summary(self, ch_names) -> str:
+        # whole session statistics per channel, for the "Logging ended" mail
+        level = max(self.levels.values(), key=lambda level: level.resolution)
+        n, lo, mean, hi, std = level.total()
+        lines = ["Summary (\u2103):"]
+        for i, name in enumerate(ch_names):
+            if not n[i]:
+                lines.append(f"{name}: no readings")
+                continue
+            lines.append(
+                f"{name}: min {lo[i]:.2f}, mean {mean[i]:.2f}, max {hi[i]:.2f}, "
+                f"std {std[i]:.2f}"
+            )
+        return "\n".join(lines)
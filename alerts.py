@@ -0,0 +1,283 @@
+from collections import namedtuple
+
+import numpy as np
+
+Alert = namedtuple("Alert", "time ch msg")
+
+# per-channel rule settings as stored in the #Rule header lines, channels of
+# sessions saved before rules existed keep the 1 degC per minute rate check
+RULE_DEFAULTS = {
+    "hyst": "",
+    "rate": "1",
+    "rate_win": "60",
+    "dev": "",
+    "dev_win": "600",
+}
+
+
+class History:
+    # sliding window of the shared timeline plus running sums per channel,
+    # appended in amortized O(1) and compacted once the dead head is large
+    def __init__(self, n_ch, window, capacity=1024) -> None:
+        self.n_ch = n_ch
+        self.window = window
+        self.start = 0
+        self.stop = 0
+        self.time = np.empty(capacity)
+        self.temp = np.empty((n_ch, capacity))
+        # cumulative sum and count of valid (non-NaN) samples for running means
+        self.csum = np.zeros((n_ch, capacity))
+        self.ccount = np.zeros((n_ch, capacity))
+
+    def append(self, time, temp) -> None:
+        k = len(time)
+        live = self.stop - self.start
+        if self.stop + k > len(self.time):
+            capacity = max(len(self.time), 2 * (live + k))
+            arrays = []
+            for a in (self.time, self.temp, self.csum, self.ccount):
+                b = np.empty(a.shape[:-1] + (capacity,))
+                b[..., :live] = a[..., self.start : self.stop]
+                arrays.append(b)
+            self.time, self.temp, self.csum, self.ccount = arrays
+            self.start, self.stop = 0, live
+
+        valid = ~np.isnan(temp)
+        last_sum = self.csum[:, self.stop - 1] if live else np.zeros(self.n_ch)
+        last_count = self.ccount[:, self.stop - 1] if live else np.zeros(self.n_ch)
+        end = self.stop + k
+        self.time[self.stop : end] = time
+        self.temp[:, self.stop : end] = temp
+        self.csum[:, self.stop : end] = last_sum[:, None] + np.cumsum(
+            np.where(valid, temp, 0), axis=1
+        )
+        self.ccount[:, self.stop : end] = last_count[:, None] + np.cumsum(valid, axis=1)
+        self.stop = end
+
+    def trim(self) -> None:
+        # keep the latest sample at least a window old as the reference point
+        if self.stop > self.start:
+            time = self.time[self.start : self.stop]
+            j = np.searchsorted(time, time[-1] - self.window, "right") - 1
+            self.start += max(j, 0)
+
+    def lookback(self, window, k):
+        # index of the latest sample at least window older than each of the last
+        # k samples, -1 where the history does not reach back that far
+        time = self.time[self.start : self.stop]
+        j = np.searchsorted(time, time[-k:] - window, "right") - 1
+        return np.where(j >= 0, j + self.start, -1)
+
+
+class Rule:
+    # per-channel parameters as arrays, NaN disables the rule on a channel;
+    # a rule fires when it becomes active and re-arms once it has cleared by
+    # the hysteresis, so a sustained condition only alerts once
+    window = 0.0
+
+    def __init__(self, n_ch) -> None:
+        self.armed = np.ones(n_ch, dtype=bool)
+
+    def evaluate(self, hist, k):
+        # (value, active, rearm) for the last k samples of hist, (n_ch, k) each
+        raise NotImplementedError
+
+    def message(self, ch, name, value) -> str:
+        raise NotImplementedError
+
+    def process(self, hist, k):
+        value, active, rearm = self.evaluate(hist, k)
+        # forward fill the last decisive event to get the state at each sample
+        event = np.where(active, 1, np.where(rearm, -1, 0))
+        idx = np.maximum.accumulate(np.where(event != 0, np.arange(k), -1), axis=1)
+        init = np.where(self.armed, -1, 1)[:, None]
+        state = np.where(
+            idx >= 0, np.take_along_axis(event, np.maximum(idx, 0), axis=1), init
+        )
+        prev = np.concatenate((init, state[:, :-1]), axis=1)
+        self.armed = state[:, -1] != 1
+        return (state == 1) & (prev != 1), value
+
+
+class ThresholdRule(Rule):
+    def __init__(self, level, hysteresis) -> None:
+        super().__init__(len(level))
+        self.level = np.asarray(level, dtype=float)
+        # infinite hysteresis never re-arms, i.e. notify only once
+        self.hysteresis = np.asarray(hysteresis, dtype=float)
+
+    def evaluate(self, hist, k):
+        temp = hist.temp[:, hist.stop - k : hist.stop]
+        with np.errstate(invalid="ignore"):
+            active = temp >= self.level[:, None]
+            rearm = temp < (self.level - self.hysteresis)[:, None]
+        return temp, active, rearm
+
+    def message(self, ch, name, value) -> str:
+        return f"{name} reached {self.level[ch]}\u2103"
+
+
+class WindowRule(Rule):
+    # compares each sample against a per-channel trailing time window
+    def __init__(self, limit, window, hysteresis=None) -> None:
+        super().__init__(len(limit))
+        self.limit = np.asarray(limit, dtype=float)
+        self.windows = np.asarray(window, dtype=float)
+        if hysteresis is None:
+            hysteresis = self.limit / 2
+        self.hysteresis = np.asarray(hysteresis, dtype=float)
+        enabled = self.windows[~np.isnan(self.limit)]
+        self.window = enabled.max() if len(enabled) else 0.0
+
+    def evaluate(self, hist, k):
+        value = np.full((hist.n_ch, k), np.nan)
+        i = np.arange(hist.stop - k, hist.stop)
+        for window in np.unique(self.windows[~np.isnan(self.limit)]):
+            chs = np.flatnonzero((self.windows == window) & ~np.isnan(self.limit))
+            j = hist.lookback(window, k)
+            value[chs] = self.deviation(hist, chs, i, np.maximum(j, hist.start))
+            value[np.ix_(chs, j < 0)] = np.nan
+        magnitude = np.abs(value)
+        with np.errstate(invalid="ignore"):
+            active = magnitude > self.limit[:, None]
+            rearm = magnitude <= (self.limit - self.hysteresis)[:, None]
+        return value, active, rearm
+
+    def deviation(self, hist, chs, i, j):
+        # (len(chs), len(i)) for samples i with reference samples j
+        raise NotImplementedError
+
+
+class RateRule(WindowRule):
+    # change between each sample and the sample one window earlier
+    def deviation(self, hist, chs, i, j):
+        return hist.temp[np.ix_(chs, i)] - hist.temp[np.ix_(chs, j)]
+
+    def message(self, ch, name, value) -> str:
+        window = self.windows[ch]
+        span = "a minute" if window == 60 else f"{window:g} s"
+        return f"{name} temperature change by {value}\u2103 in {span}"
+
+
+class AverageRule(WindowRule):
+    # deviation of each sample from the running mean of the samples after j
+    def deviation(self, hist, chs, i, j):
+        total = hist.csum[np.ix_(chs, i)] - hist.csum[np.ix_(chs, j)]
+        count = hist.ccount[np.ix_(chs, i)] - hist.ccount[np.ix_(chs, j)]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return hist.temp[np.ix_(chs, i)] - total / count
+
+    def message(self, ch, name, value) -> str:
+        window = self.windows[ch]
+        return f"{name} deviates by {value:+.2f}\u2103 from its {window:g} s average"
+
+
+class AlertEngine:
+    # evaluates all rules over all channels a block at a time
+    def __init__(self, rules, ch_names) -> None:
+        self.rules = rules
+        self.ch_names = ch_names
+        window = max([rule.window for rule in rules] + [0.0])
+        self.hist = History(len(ch_names), window)
+
+    @classmethod
+    def from_config(cls, config) -> "AlertEngine":
+        channels = [c for _, c in sorted(config["channels"].items()) if c["on"]]
+
+        def setting(key, blank=np.nan):
+            values = []
+            for c in channels:
+                try:
+                    values.append(float(c.get(key, RULE_DEFAULTS.get(key, ""))))
+                except ValueError:
+                    values.append(blank)
+            return np.array(values)
+
+        # a notification temperature of 0 has always meant none
+        notify = setting("notify")
+        notify[notify == 0] = np.nan
+        engine = cls(
+            [
+                ThresholdRule(notify, setting("hyst", np.inf)),
+                RateRule(setting("rate"), setting("rate_win", 60)),
+                AverageRule(setting("dev"), setting("dev_win", 600)),
+            ],
+            [c["name"] for c in channels],
+        )
+        engine.threshold, engine.rate, engine.average = engine.rules
+        return engine
+
+    def process(self, time, temp):
+        # alerts raised by a (time, temp) block, in time order
+        k = len(time)
+        if not k:
+            return []
+        self.hist.append(time, temp)
+        alerts = []
+        for rule in self.rules:
+            fired, value = rule.process(self.hist, k)
+            for ch, i in zip(*np.nonzero(fired)):
+                msg = rule.message(ch, self.ch_names[ch], value[ch, i])
+                alerts.append(Alert(time[i], ch, msg))
+        self.hist.trim()
+        return sorted(alerts, key=lambda alert: alert.time)
+
+
+class AlertAggregator:
+    # merges the alerts raised within window seconds into one message, mails a
+    # channel at most every ch_interval and the list at most every mail_interval;
+    # alerts held back by the limits are counted and reported in the next mail
+    WINDOW = 30  # s
+    CH_INTERVAL = 600  # s
+    MAIL_INTERVAL = 60  # s
+    MAX_LINES = 50
+
+    def __init__(
+        self,
+        ch_names,
+        window=WINDOW,
+        ch_interval=CH_INTERVAL,
+        mail_interval=MAIL_INTERVAL,
+    ) -> None:
+        self.ch_names = ch_names
+        self.window = window
+        self.ch_interval = ch_interval
+        self.mail_interval = mail_interval
+        self.pending = []
+        self.first = None
+        self.last_mail = -np.inf
+        self.ch_last = np.full(len(ch_names), -np.inf)
+        self.suppressed = np.zeros(len(ch_names), dtype=int)
+
+    def add(self, alert, now) -> None:
+        limited = now - self.ch_last[alert.ch] < self.ch_interval
+        if limited or len(self.pending) >= self.MAX_LINES:
+            self.suppressed[alert.ch] += 1
+            return
+        if not self.pending:
+            self.first = now
+        self.pending.append(alert)
+
+    def poll(self, now):
+        # the merged message once the window has passed and the list may be
+        # mailed again, None otherwise
+        if not self.pending or now - self.first < self.window:
+            return None
+        if now - self.last_mail < self.mail_interval:
+            return None
+        return self.flush(now)
+
+    def flush(self, now) -> str:
+        lines = [f"[{alert.time:.1f} s] {alert.msg}" for alert in self.pending]
+        if self.suppressed.any():
+            counts = [
+                f"{name} x{n}" for name, n in zip(self.ch_names, self.suppressed) if n
+            ]
+            lines.append(f"Suppressed by rate limits: {', '.join(counts)}")
+        for alert in self.pending:
+            self.ch_last[alert.ch] = now
+        self.pending = []
+        self.suppressed[:] = 0
+        if lines:
+            self.last_mail = now
+        return "\n".join(lines)
@@ -0,0 +1,249 @@
+from aggregate import Aggregates
+from catalog import find_sessions, session_name
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from device import channel_label
+from os.path import basename, expanduser, join
+from session import (
+    BINARY_EXT,
+    BinarySessionWriter,
+    SessionWriter,
+    iter_session,
+    parse_header,
+)
+
+import argparse
+import csv
+import numpy as np
+import os
+import sys
+
+# summary table columns, one row per channel of every session
+COLUMNS = [
+    "session",
+    "channel",
+    "name",
+    "samples",
+    "missing",
+    "duration_s",
+    "min",
+    "mean",
+    "max",
+    "std",
+    "threshold",
+    "first_crossing_s",
+    "crossings",
+    "max_change",
+    "max_change_s",
+]
+RATE_WINDOW = 60  # s
+BATCH_CHUNK_BYTES = 1 << 22
+
+
+class SessionAnalysis:
+    # per-channel statistics of one session accumulated chunk by chunk: the
+    # hourly aggregates for min/mean/max/std, upward crossings of each channel's
+    # notification temperature and the largest change within rate_window s
+    def __init__(self, levels, rate_window=RATE_WINDOW) -> None:
+        n_ch = len(levels)
+        self.levels = np.asarray(levels, dtype=float)
+        self.rate_window = rate_window
+        self.aggregates = Aggregates(n_ch, resolutions={"1h": 3600})
+        self.samples = 0
+        self.start = self.end = None
+        # last valid reading per channel, crossings span chunk boundaries
+        self.last = np.full(n_ch, np.nan)
+        self.first_crossing = np.full(n_ch, np.nan)
+        self.crossings = np.zeros(n_ch, dtype=int)
+        # samples within rate_window of the end of the previous chunk
+        self.tail_time = np.empty(0)
+        self.tail_temp = np.empty((n_ch, 0))
+        self.max_change = np.full(n_ch, np.nan)
+        self.max_change_time = np.full(n_ch, np.nan)
+
+    def update(self, time, temp) -> None:
+        if not len(time):
+            return
+        temp = np.asarray(temp, dtype=float)
+        self.samples += len(time)
+        self.start = time[0] if self.start is None else self.start
+        self.end = time[-1]
+        self.aggregates.update(time, temp)
+        self.update_crossings(time, temp)
+        self.update_change(time, temp)
+
+    def update_crossings(self, time, temp) -> None:
+        # gaps hold the last valid reading
+        valid = ~np.isnan(temp)
+        idx = np.maximum.accumulate(np.where(valid, np.arange(len(time)), -1), axis=1)
+        filled = np.where(
+            idx >= 0,
+            np.take_along_axis(temp, np.maximum(idx, 0), axis=1),
+            self.last[:, None],
+        )
+        prev = np.concatenate((self.last[:, None], filled[:, :-1]), axis=1)
+        level = self.levels[:, None]
+        with np.errstate(invalid="ignore"):
+            crossed = (prev < level) & (filled >= level)
+        self.crossings += crossed.sum(axis=1)
+        first = crossed.argmax(axis=1)
+        new = crossed.any(axis=1) & np.isnan(self.first_crossing)
+        self.first_crossing[new] = time[first[new]]
+        self.last = filled[:, -1]
+
+    def update_change(self, time, temp) -> None:
+        # change of each sample from the latest one at least rate_window older
+        k = len(self.tail_time)
+        time = np.concatenate((self.tail_time, time))
+        temp = np.concatenate((self.tail_temp, temp), axis=1)
+        j = np.searchsorted(time, time[k:] - self.rate_window, "right") - 1
+        change = temp[:, k:] - temp[:, np.maximum(j, 0)]
+        change[:, j < 0] = np.nan
+        magnitude = np.abs(change)
+        has = ~np.isnan(magnitude).all(axis=1)
+        i = np.nanargmax(np.where(has[:, None], magnitude, 0), axis=1)
+        best = magnitude[np.arange(len(i)), i]
+        better = has & ~(best <= np.abs(self.max_change))
+        self.max_change[better] = change[better, i[better]]
+        self.max_change_time[better] = time[k + i[better]]
+
+        start = np.searchsorted(time, time[-1] - self.rate_window, "right") - 1
+        start = max(start, 0)
+        self.tail_time, self.tail_temp = time[start:], temp[:, start:]
+
+    def rows(self, session, ch_ids, ch_names):
+        n, lo, mean, hi, std = self.aggregates.levels["1h"].total()
+        duration = self.end - self.start if self.samples else 0.0
+        for i, (ch, name) in enumerate(zip(ch_ids, ch_names)):
+            yield {
+                "session": session,
+                "channel": channel_label(ch) if ch else "",
+                "name": name,
+                "samples": self.samples,
+                "missing": self.samples - int(n[i]),
+                "duration_s": duration,
+                "min": lo[i],
+                "mean": mean[i],
+                "max": hi[i],
+                "std": std[i],
+                "threshold": self.levels[i],
+                "first_crossing_s": self.first_crossing[i],
+                "crossings": self.crossings[i],
+                "max_change": self.max_change[i],
+                "max_change_s": self.max_change_time[i],
+            }
+
+
+def parse_level(text) -> float:
+    # notification temperature from the header, NaN (never crossed) if unset
+    # or 0, which means unset too
+    try:
+        return float(text) or np.nan
+    except ValueError:
+        return np.nan
+
+
+def analyze(path, threshold=None, rate_window=RATE_WINDOW, convert_dir=None):
+    # summary rows of one session, run in a worker process; the session is
+    # streamed, and optionally rewritten in the other format, chunk by chunk
+    header, ch_names, blocks = iter_session(path, BATCH_CHUNK_BYTES)
+    config = parse_header(header)
+    channels = [(ch, c) for ch, c in sorted(config["channels"].items()) if c["on"]]
+    if len(channels) != len(ch_names):
+        # config and columns disagree, e.g. a hand-written file
+        channels = [(None, {})] * len(ch_names)
+    levels = [threshold] * len(channels)
+    if threshold is None:
+        levels = [parse_level(c.get("notify", "")) for _, c in channels]
+
+    session = session_name(path)
+    writer = None
+    if convert_dir:
+        binary = BINARY_EXT not in basename(path)
+        out = join(convert_dir, session + (BINARY_EXT if binary else ".csv"))
+        writer_cls = BinarySessionWriter if binary else SessionWriter
+        writer = writer_cls(out, header, ch_names)
+    analysis = SessionAnalysis(levels, rate_window)
+    try:
+        for time_block, temp_block in blocks:
+            analysis.update(time_block, temp_block)
+            if writer:
+                writer.write(time_block, np.asarray(temp_block, dtype=float))
+    finally:
+        if writer:
+            writer.close()
+    return list(analysis.rows(session, [ch for ch, _ in channels], ch_names))
+
+
+def format_cell(value) -> str:
+    if isinstance(value, (float, np.floating)):
+        return "" if np.isnan(value) else f"{value:.6g}"
+    return str(value)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Summarize every TC-08 session in a directory into one table, "
+        "one worker process per core"
+    )
+    parser.add_argument(
+        "directory",
+        nargs="?",
+        default=expanduser(join("~", "Documents", "tc08")),
+    )
+    parser.add_argument("-o", "--output", default="tc08_summary.csv")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=os.cpu_count(), help="worker processes"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        help="crossing temperature for all channels instead of each session's "
+        "notification temperatures",
+    )
+    parser.add_argument(
+        "--rate-window",
+        type=float,
+        default=RATE_WINDOW,
+        help="s over which the max change is measured",
+    )
+    parser.add_argument(
+        "--convert-dir",
+        help="also rewrite each session in the other format (CSV <-> "
+        f"{BINARY_EXT}) into this directory",
+    )
+    args = parser.parse_args(argv)
+
+    paths = find_sessions(args.directory)
+    print(f"{len(paths)} sessions in {args.directory}")
+    if args.convert_dir:
+        os.makedirs(args.convert_dir, exist_ok=True)
+
+    results, failed = {}, 0
+    with ProcessPoolExecutor(max(args.jobs, 1)) as pool:
+        futures = {
+            pool.submit(
+                analyze, path, args.threshold, args.rate_window, args.convert_dir
+            ): path
+            for path in paths
+        }
+        for i, future in enumerate(as_completed(futures), 1):
+            path = futures[future]
+            try:
+                results[path] = future.result()
+                print(f"[{i}/{len(paths)}] {basename(path)}")
+            except Exception as e:
+                failed += 1
+                print(f"[{i}/{len(paths)}] {basename(path)} skipped: {e}")
+
+    with open(args.output, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for path in sorted(results):
+            for row in results[path]:
+                writer.writerow([format_cell(row[column]) for column in COLUMNS])
+    print(f"summary written to {args.output}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
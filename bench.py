@@ -0,0 +1,267 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from acquisition import CALLS, MODES, AcquisitionGroup, AcquisitionWorker
+from alerts import AlertAggregator, AlertEngine
+from device import THERMOCOUPLE, SimulatedDevice
+from mailer import LocalMailer
+from PyQt5 import QtWidgets
+from session import BinarySessionWriter, SessionWriter, read_session
+from store import SampleStore
+
+import numpy as np
+import tc08
+
+
+def rss_mb():
+    # current resident set size, None where it cannot be read
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss / 2**20
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return None
+
+
+def percentiles(samples_ms):
+    samples_ms = np.asarray(samples_ms)
+    if not len(samples_ms):
+        return {}
+    p50, p90, p99 = np.percentile(samples_ms, [50, 90, 99])
+    return {
+        "p50": p50,
+        "p90": p90,
+        "p99": p99,
+        "max": samples_ms.max(),
+        "n": len(samples_ms),
+    }
+
+
+def bench_window(args, tmp_dir):
+    # drives the MainWindow pipeline tick by tick against a manually clocked
+    # simulator, prefilling whole hours in between measured ticks
+    class BenchWindow(tc08.MainWindow):
+        FILE_PATH = tmp_dir
+        save_dir = tmp_dir
+
+    device = SimulatedDevice(speed=0, min_interval_ms=args.samp_int, seed=0)
+    w = BenchWindow([device], LocalMailer("Benchmark", ""))
+    w.resize(1200, 600)
+    w.show()
+    channels = [(1, ch) for ch in range(1, args.channels + 1)]
+    for ch in channels:
+        w.ch_dialogs[ch] = tc08.ChannelDialog(ch)
+    w.selected_ch = channels
+    w.mail_addresses = []
+    w.alerts = AlertEngine.from_config(w.config())
+    w.notifier = AlertAggregator(w.alerts.ch_names)
+    w.worker = AcquisitionGroup(
+        w.devices, channels, w.THERMOCOUPLE["K"], args.samp_int
+    )
+    w.run_samp_int = w.worker.configure()
+    worker = w.worker.workers[0]
+    w.store = SampleStore(len(channels))
+    w.init_plot()
+    w.session_time = tc08.now()
+    w.open_session()
+
+    results = []
+    done_h = 0.0
+    poll_s = w.worker.poll_int / 1000
+    for hours in args.hours:
+        # prefill up to the checkpoint through the regular read/update_plot path
+        while done_h < hours:
+            step_h = min(1.0, hours - done_h)
+            n = int(step_h * 3600 * 1000 / w.run_samp_int) + 100
+            device.BUFFER_LEN = worker.BUFFER_LEN = worker.scheduler.buffer_len = n
+            device.advance(step_h * 3600)
+            w.worker.read()
+            w.update_plot()
+            done_h += step_h
+        device.BUFFER_LEN = worker.BUFFER_LEN = AcquisitionWorker.BUFFER_LEN
+        worker.scheduler.buffer_len = AcquisitionWorker.BUFFER_LEN
+
+        update_ms, refresh_ms = [], []
+        for _ in range(args.ticks):
+            device.advance(poll_s)
+            w.worker.read()
+            t0 = time.perf_counter()
+            w.update_plot()
+            t1 = time.perf_counter()
+            w.refresh_curves()
+            t2 = time.perf_counter()
+            update_ms.append((t1 - t0) * 1000)
+            refresh_ms.append((t2 - t1) * 1000)
+        QtWidgets.QApplication.processEvents()
+        results.append(
+            {
+                "hours": hours,
+                "samples": len(w.store),
+                "rss_mb": rss_mb(),
+                "update_plot_ms": percentiles(update_ms),
+                "refresh_curves_ms": percentiles(refresh_ms),
+            }
+        )
+        print(f"{hours} h: {results[-1]}")
+
+    mail = bench_mail(w, args.mails)
+    w.writer.close()
+    w.writer = None
+    w.close()
+    return results, mail
+
+
+def bench_mail(w, n):
+    compile_ms, compose_ms = [], []
+    for _ in range(n):
+        # new data each round, so every mail pays for a full render
+        w.snapshots.key = None
+        runnable = tc08.MailingThread(w.mailer, w.snapshot(), "Benchmark")
+        w.mailer.mail_new()
+        t0 = time.perf_counter()
+        runnable.mail_compile()
+        t1 = time.perf_counter()
+        w.mailer.mail_body(runnable.msg)
+        w.mailer.written_mail.as_string()
+        t2 = time.perf_counter()
+        compile_ms.append((t1 - t0) * 1000)
+        compose_ms.append((t2 - t1) * 1000)
+    return {"attach_ms": percentiles(compile_ms), "compose_ms": percentiles(compose_ms)}
+
+
+def bench_modes(args):
+    # streaming against single reads in real time on a simulated unit with
+    # realistic conversion times: rows and valid readings per second, USB round
+    # trips per second and the age of the newest sample when it is consumed
+    results = {}
+    channels = [(1, ch) for ch in range(1, args.channels + 1)]
+    for mode in MODES:
+        device = SimulatedDevice(seed=0)
+        device.open_unit()
+        group = AcquisitionGroup(
+            {1: device}, channels, THERMOCOUPLE["K"], args.mode_int, mode
+        )
+        samp_int = group.configure()
+        calls = CALLS.total()
+        ages_ms, rows, valid = [], 0, 0
+        group.start()
+        t0 = time.monotonic()
+        while time.monotonic() - t0 < args.mode_seconds:
+            time.sleep(group.poll_int / 1000)
+            time_block, temp_block = group.drain()
+            if time_block is None:
+                continue
+            newest = group.workers[0].started + time_block[-1]
+            ages_ms.append((time.monotonic() - newest) * 1000)
+            rows += len(time_block)
+            valid += int(np.isfinite(temp_block).sum())
+        elapsed = time.monotonic() - t0
+        group.stop()
+        results[mode] = {
+            "samp_int": samp_int,
+            "rows_s": rows / elapsed,
+            "readings_s": valid / elapsed,
+            "calls_s": (CALLS.total() - calls) / elapsed,
+            "age_ms": percentiles(ages_ms),
+        }
+        print(f"{mode}: {results[mode]}")
+    return results
+
+
+def bench_files(args, tmp_dir):
+    n_ch = args.channels
+    rng = np.random.default_rng(0)
+    time_data = np.arange(args.rows) * args.samp_int / 1000
+    temp_data = (20 + rng.normal(size=(n_ch, args.rows))).astype(np.float32)
+    temp_data = temp_data.astype(float)
+    header = ["# Configurations", f"#Dir {tmp_dir}", f"#Samp {args.samp_int}"]
+    ch_names = [f"Ch. {ch}" for ch in range(1, n_ch + 1)]
+    block = 1000
+
+    results = {}
+    for name, cls, ext in [
+        ("csv", SessionWriter, ".csv"),
+        ("binary", BinarySessionWriter, ".tcb"),
+    ]:
+        path = os.path.join(tmp_dir, "bench" + ext)
+        t0 = time.perf_counter()
+        writer = cls(path, header, ch_names)
+        for i in range(0, args.rows, block):
+            writer.write(time_data[i : i + block], temp_data[:, i : i + block])
+        writer.close()
+        write_s = time.perf_counter() - t0
+        size = os.path.getsize(path)
+
+        t0 = time.perf_counter()
+        _, _, loaded_time, loaded_temp = read_session(path)
+        loaded_temp.sum()
+        load_s = time.perf_counter() - t0
+        results[name] = {
+            "rows": args.rows,
+            "bytes": size,
+            "write_s": write_s,
+            "write_mb_s": size / 2**20 / write_s,
+            "load_s": load_s,
+            "load_rows_s": args.rows / load_s,
+        }
+        print(f"{name}: {results[name]}")
+        del loaded_time, loaded_temp
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the TC-08 logger headless against a simulated device"
+    )
+    parser.add_argument(
+        "--hours",
+        type=lambda s: [float(h) for h in s.split(",")],
+        default=[1, 6, 24],
+        help="comma separated session lengths to measure ticks at",
+    )
+    parser.add_argument("--samp-int", type=int, default=100, help="ms")
+    parser.add_argument("--channels", type=int, default=8)
+    parser.add_argument("--ticks", type=int, default=200)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--mails", type=int, default=5)
+    parser.add_argument(
+        "--mode-int", type=int, default=1000, help="ms, to compare modes at"
+    )
+    parser.add_argument("--mode-seconds", type=float, default=10)
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    app = QtWidgets.QApplication(sys.argv)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        ticks, mail = bench_window(args, tmp_dir)
+        files = bench_files(args, tmp_dir)
+    modes = bench_modes(args)
+
+    results = {
+        "meta": {
+            "time": tc08.now(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "ticks": ticks,
+        "mail": mail,
+        "files": files,
+        "modes": modes,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2, default=float)
+    print(f"results written to {args.output}")
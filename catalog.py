@@ -0,0 +1,241 @@
+from aggregate import RESOLUTIONS, aggregate_path
+from os.path import basename, join, splitext
+from session import (
+    BINARY_EXT,
+    GZIP_EXT,
+    SEGMENT_RE,
+    open_session_file,
+    read_session,
+    read_session_header,
+    segment_blocks,
+    select_rows,
+    session_segments,
+)
+
+import glob
+import json
+import numpy as np
+import os
+
+CATALOG_FILE = ".tc08_catalog.json"
+CATALOG_VERSION = 1
+# bytes of session file between seek points, bounds what a windowed read parses
+# before reaching its first row
+INDEX_BYTES = 1 << 20
+
+
+def find_sessions(directory):
+    # one path per session in directory, the first segment of rotated ones;
+    # aggregate files and other CSVs without a session header are left out
+    aggregates = tuple(aggregate_path("", name) for name in RESOLUTIONS)
+    sessions = set()
+    for path in glob.glob(join(glob.escape(directory), "*")):
+        name = path[: -len(GZIP_EXT)] if path.endswith(GZIP_EXT) else path
+        if not name.endswith((".csv", BINARY_EXT)) or name.endswith(aggregates):
+            continue
+        segments = session_segments(path)
+        if segments and is_session(segments[0]):
+            sessions.add(segments[0])
+    return sorted(sessions)
+
+
+def is_session(path) -> bool:
+    try:
+        if BINARY_EXT in basename(path):
+            read_session_header(path)
+            return True
+        with open_session_file(path) as f:
+            return f.readline().startswith("# Configurations")
+    except (OSError, ValueError, UnicodeDecodeError):
+        return False
+
+
+def session_name(path) -> str:
+    # file name without segment number and extensions
+    match = SEGMENT_RE.match(path)
+    if match:
+        return basename(match["stem"])
+    if path.endswith(GZIP_EXT):
+        path = path[: -len(GZIP_EXT)]
+    return splitext(basename(path))[0]
+
+
+def to_json(values):
+    # JSON has no NaN/inf, channels without readings are stored as null
+    return [float(v) if np.isfinite(v) else None for v in values]
+
+
+def from_json(values) -> np.ndarray:
+    return np.array([np.nan if v is None else v for v in values], dtype=float)
+
+
+def scan_segment(path, n_ch, entry=None):
+    # catalog entry of one session file: size and mtime to detect changes, rows,
+    # time span, per-channel min/max and (time, offset) seek points; given the
+    # entry of an uncompressed file that has grown since, e.g. the segment being
+    # logged to, only the appended rows are read
+    stat = os.stat(path)
+    resume = (
+        entry is not None
+        and not path.endswith(GZIP_EXT)
+        and stat.st_size >= entry["size"]
+    )
+    if not resume:
+        entry = {
+            "rows": 0,
+            "start": None,
+            "end": None,
+            "min": [None] * n_ch,
+            "max": [None] * n_ch,
+            "seek": [],
+            "parsed": None,
+        }
+    entry = dict(entry, file=basename(path), size=stat.st_size)
+    entry["mtime"] = stat.st_mtime_ns
+    lo, hi = from_json(entry["min"]), from_json(entry["max"])
+    seek = list(entry["seek"])
+    for start, end, time_block, temp_block in segment_blocks(
+        path, INDEX_BYTES, entry["parsed"]
+    ):
+        if not len(time_block):
+            continue
+        if not seek or start - seek[-1][1] >= INDEX_BYTES:
+            seek.append([float(time_block[0]), start])
+        entry["rows"] += len(time_block)
+        if entry["start"] is None:
+            entry["start"] = float(time_block[0])
+        entry["end"] = float(time_block[-1])
+        lo = np.fmin(lo, np.fmin.reduce(temp_block, axis=1, initial=np.inf))
+        hi = np.fmax(hi, np.fmax.reduce(temp_block, axis=1, initial=-np.inf))
+        entry["parsed"] = end
+    entry["min"], entry["max"], entry["seek"] = to_json(lo), to_json(hi), seek
+    return entry
+
+
+def scan_session(path, entry=None):
+    # catalog entry of the session starting at path, only (re)reading segments
+    # that are new or changed since the previous entry
+    segments = session_segments(path)
+    if not segments:
+        raise FileNotFoundError(f"No session at {path}")
+    header, ch_names = read_session_header(segments[0])
+    known = {}
+    if entry is not None and entry["ch_names"] == ch_names:
+        known = {segment["file"]: segment for segment in entry["segments"]}
+
+    scanned = []
+    for segment in segments:
+        old = known.get(basename(segment))
+        stat = os.stat(segment)
+        if old and (old["size"], old["mtime"]) == (stat.st_size, stat.st_mtime_ns):
+            scanned.append(old)
+        else:
+            scanned.append(scan_segment(segment, len(ch_names), old))
+    if entry is not None and scanned == entry["segments"]:
+        return entry
+
+    spans = [s for s in scanned if s["rows"]]
+    lo = np.fmin.reduce([from_json(s["min"]) for s in scanned], axis=0)
+    hi = np.fmax.reduce([from_json(s["max"]) for s in scanned], axis=0)
+    return {
+        "name": session_name(path),
+        "header": header,
+        "ch_names": ch_names,
+        "rows": sum(s["rows"] for s in scanned),
+        "start": spans[0]["start"] if spans else None,
+        "end": spans[-1]["end"] if spans else None,
+        "min": to_json(lo),
+        "max": to_json(hi),
+        "segments": scanned,
+    }
+
+
+class Catalog:
+    # persistent index of the sessions saved in a directory, kept as JSON in
+    # CATALOG_FILE there so sessions can be listed, filtered and partly read
+    # without parsing them; refresh() only reads files new or changed since
+    def __init__(self, directory) -> None:
+        self.directory = directory
+        self.path = join(directory, CATALOG_FILE)
+        self.sessions = {}  # by file name of the session's (first) file
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get("version") == CATALOG_VERSION:
+                self.sessions = data["sessions"]
+        except (OSError, ValueError):
+            pass  # missing or unreadable, rebuilt by refresh()
+
+    def refresh(self) -> bool:
+        # whether any session was added, changed or removed
+        sessions = {}
+        for path in find_sessions(self.directory):
+            key = basename(path)
+            try:
+                sessions[key] = scan_session(path, self.sessions.get(key))
+            except (OSError, ValueError) as e:
+                print(f"Session {path} not indexed: {e}")
+        changed = sessions.keys() != self.sessions.keys() or any(
+            entry is not self.sessions[key] for key, entry in sessions.items()
+        )
+        self.sessions = sessions
+        if changed:
+            self.save()
+        return changed
+
+    def save(self) -> None:
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"version": CATALOG_VERSION, "sessions": self.sessions}, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"Catalog {self.path} not saved: {e}")
+
+    def find(self, text="", t_range=None):
+        # keys of the sessions whose file name, channel names or header contain text
+        # and, given t_range, that have readings within it, newest first
+        text = text.lower()
+        keys = []
+        for key, entry in self.sessions.items():
+            fields = [key] + entry["ch_names"] + entry["header"]
+            if text and not any(text in field.lower() for field in fields):
+                continue
+            if t_range is not None and (
+                entry["start"] is None
+                or entry["end"] < t_range[0]
+                or entry["start"] > t_range[1]
+            ):
+                continue
+            keys.append(key)
+        return sorted(keys, key=lambda key: self.sessions[key]["name"], reverse=True)
+
+    def read(self, key, t_range=None):
+        # (header, ch_names, time, temp) of a session, or of its rows within
+        # t_range read from the nearest seek points of the segments spanning it
+        path = join(self.directory, key)
+        if t_range is None:
+            return read_session(path)
+        entry = self.sessions[key]
+        times, temps = [np.empty(0)], [np.empty((len(entry["ch_names"]), 0))]
+        # the empty blocks keep concatenate happy for windows without rows
+        for segment in entry["segments"]:
+            if not segment["rows"] or not (
+                segment["start"] <= t_range[1] and segment["end"] >= t_range[0]
+            ):
+                continue
+            offsets = [offset for t, offset in segment["seek"] if t <= t_range[0]]
+            blocks = segment_blocks(
+                join(self.directory, segment["file"]),
+                INDEX_BYTES,
+                offsets[-1] if offsets else None,
+            )
+            for _, _, time_block, temp_block in blocks:
+                rows = select_rows(time_block, t_range=t_range)
+                times.append(time_block[rows])
+                temps.append(temp_block[:, rows])
+                if time_block[-1] > t_range[1]:
+                    break
+        time_data = np.concatenate(times)
+        temp_data = np.concatenate(temps, axis=1)
+        return entry["header"], entry["ch_names"], time_data, temp_data
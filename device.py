@@ -0,0 +1,329 @@
+import ctypes
+import itertools
+import numpy as np
+import time
+
+try:
+    from picosdk.usbtc08 import usbtc08 as tc08
+except (ImportError, OSError):
+    # the simulated device works without the PicoSDK driver installed
+    tc08 = None
+
+
+THERMOCOUPLE = {
+    "B": 66,
+    "E": 69,
+    "J": 74,
+    "K": 75,
+    "N": 78,
+    "R": 82,
+    "S": 83,
+    "T": 84,
+    "X": 88,
+}
+
+
+# units are numbered from 1 in serial number order, the driver handles up to 64
+MAX_UNITS = 64
+
+
+class DeviceError(IOError):
+    pass
+
+
+def channel_id(text):
+    # (unit, channel) from "3" (channel 3 of the first unit) or "2:3"
+    unit, _, ch = str(text).strip().rpartition(":")
+    return int(unit or 1), int(ch)
+
+
+def channel_label(ch_id) -> str:
+    # inverse of channel_id, channels of the first unit keep their bare number
+    # so single unit sessions read as before
+    unit, ch = ch_id
+    return f"{ch}" if unit == 1 else f"{unit}:{ch}"
+
+
+class PicoDevice:
+    # TC-08 through the picosdk ctypes wrapper, one unit per instance
+    BUFFER_LEN = 600
+
+    def __init__(self) -> None:
+        if tc08 is None:
+            raise DeviceError("picosdk and the TC-08 driver are required")
+        self.handle = 0
+        self.temp_buffer = (ctypes.c_float * self.BUFFER_LEN)()
+        self.time_buffer = (ctypes.c_int32 * self.BUFFER_LEN)()
+        self.overflow = ctypes.c_int16()
+        self.single_buffer = (ctypes.c_float * 9)()
+
+    def check(self, status) -> int:
+        if status <= 0:
+            raise DeviceError(f"TC-08 error: {self.get_last_error()}")
+        return status
+
+    def open_unit(self) -> int:
+        # > 0 handle, 0 no unit found, -1 error
+        self.handle = tc08.usb_tc08_open_unit()
+        return self.handle
+
+    def get_last_error(self) -> int:
+        return tc08.usb_tc08_get_last_error(max(self.handle, 0))
+
+    def serial(self) -> str:
+        info = ctypes.create_string_buffer(256)
+        # line 4 is USBTC08LINE_BATCH_AND_SERIAL
+        tc08.usb_tc08_get_unit_info2(self.handle, info, len(info), 4)
+        return info.value.decode("ascii", "replace")
+
+    def set_mains(self, sixty_hertz=0) -> None:
+        self.check(tc08.usb_tc08_set_mains(self.handle, sixty_hertz))
+
+    def set_channel(self, ch, tc_type) -> None:
+        self.check(tc08.usb_tc08_set_channel(self.handle, ch, tc_type))
+
+    def get_minimum_interval_ms(self) -> int:
+        return self.check(tc08.usb_tc08_get_minimum_interval_ms(self.handle))
+
+    def run(self, samp_int) -> int:
+        return self.check(tc08.usb_tc08_run(self.handle, samp_int))
+
+    def get_temp(self, ch, max_len=BUFFER_LEN):
+        # (temp in degC, time in ms, overflow) of the readings since the last call,
+        # missed readings keep their slot as QNaN rather than the previous value
+        n = tc08.usb_tc08_get_temp(
+            self.handle,  # handle
+            ctypes.byref(self.temp_buffer),  # temp_buffer
+            ctypes.byref(self.time_buffer),  # times_ms_buffer
+            min(max_len, self.BUFFER_LEN),  # buffer_length
+            ctypes.byref(self.overflow),  # overflow
+            ch,  # channel
+            tc08.USBTC08_UNITS["USBTC08_UNITS_CENTIGRADE"],  # units
+            0,  # fill_missing
+        )
+        if n < 0:
+            raise DeviceError(f"TC-08 error: {self.get_last_error()}")
+        return (
+            np.frombuffer(self.temp_buffer, np.float32, n).copy(),
+            np.frombuffer(self.time_buffer, np.int32, n).copy(),
+            bool(self.overflow.value),
+        )
+
+    def get_single(self):
+        # (temp in degC of the cold junction and channels 1-8, over range bits
+        # by channel) in one transaction, blocking for the conversions; only
+        # while not streaming
+        self.check(
+            tc08.usb_tc08_get_single(
+                self.handle,  # handle
+                ctypes.byref(self.single_buffer),  # temp
+                ctypes.byref(self.overflow),  # overflow_flags
+                tc08.USBTC08_UNITS["USBTC08_UNITS_CENTIGRADE"],  # units
+            )
+        )
+        temp = np.frombuffer(self.single_buffer, np.float32).copy()
+        return temp, self.overflow.value
+
+    def stop(self) -> None:
+        if self.handle > 0:
+            tc08.usb_tc08_stop(self.handle)
+
+    def close_unit(self) -> None:
+        if self.handle > 0:
+            tc08.usb_tc08_close_unit(self.handle)
+            self.handle = 0
+
+
+class SimulatedDevice:
+    # stand-in for a TC-08 following fake_temperature_data, speed scales the
+    # device clock (0 only advances through advance()) for stress tests and
+    # missing_prob misses single readings like a real unit occasionally does,
+    # NaN in their slot as the driver returns them
+    BUFFER_LEN = 600
+    NOISE = ("gaussian", "drift", "none")
+    _serials = itertools.count(1)
+
+    def __init__(
+        self,
+        n_ch=8,
+        speed=1.0,
+        noise="gaussian",
+        noise_std=3.0,
+        overflow_prob=0.0,
+        missing_prob=0.0,
+        jitter_ms=0.0,
+        min_interval_ms=None,
+        seed=None,
+    ) -> None:
+        if noise not in self.NOISE:
+            raise ValueError(f"noise must be one of {self.NOISE}")
+        self.n_ch = n_ch
+        self.speed = speed
+        self.noise = noise
+        self.noise_std = noise_std
+        self.overflow_prob = overflow_prob
+        self.missing_prob = missing_prob
+        self.jitter_ms = jitter_ms
+        self.min_interval_ms = min_interval_ms
+        self.rng = np.random.default_rng(seed)
+        self._serial = f"SIM{next(self._serials):05d}"
+        self.handle = 0
+        self.channels = set()
+        self.samp_int = None
+        self._t0 = 0.0
+        self._offset = 0.0
+        self._next = {}
+        self._drift = {}
+
+    def open_unit(self) -> int:
+        self.handle = 1
+        self._t0 = time.monotonic()
+        return self.handle
+
+    def get_last_error(self) -> int:
+        return 0
+
+    def serial(self) -> str:
+        return self._serial
+
+    def set_mains(self, sixty_hertz=0) -> None:
+        pass
+
+    def set_channel(self, ch, tc_type) -> None:
+        if not 1 <= ch <= self.n_ch:
+            raise DeviceError(f"TC-08 error: channel {ch} not available")
+        self.channels.add(ch)
+
+    def get_minimum_interval_ms(self) -> int:
+        if self.min_interval_ms is not None:
+            return self.min_interval_ms
+        # roughly the real unit: one conversion per channel plus cold junction
+        return 100 * (len(self.channels) + 1)
+
+    def run(self, samp_int) -> int:
+        self.samp_int = max(int(samp_int), self.get_minimum_interval_ms())
+        self._t0 = time.monotonic()
+        self._offset = 0.0
+        self._next = {ch: 0 for ch in self.channels}
+        self._drift = {ch: 0.0 for ch in self.channels}
+        return self.samp_int
+
+    def advance(self, seconds) -> None:
+        self._offset += seconds
+
+    def elapsed_ms(self) -> float:
+        return ((time.monotonic() - self._t0) * self.speed + self._offset) * 1000
+
+    def get_temp(self, ch, max_len=BUFFER_LEN):
+        if not self.samp_int or ch not in self._next:
+            return np.empty(0, np.float32), np.empty(0, np.int32), False
+        due = int(self.elapsed_ms() // self.samp_int) + 1
+        first = self._next[ch]
+        overflow = False
+        if due - first > self.BUFFER_LEN:
+            first = due - self.BUFFER_LEN
+            overflow = True
+        if due - first > 1 and self.rng.random() < self.overflow_prob:
+            first += int(self.rng.integers(1, due - first))
+            overflow = True
+        n = max(min(due - first, max_len), 0)
+        self._next[ch] = first + n
+
+        k = np.arange(first, first + n)
+        times = k * float(self.samp_int)
+        if self.jitter_ms:
+            times += self.rng.normal(0, self.jitter_ms, n)
+            times = np.maximum.accumulate(np.maximum(times, 0))
+        temps = self.readings(ch, times)
+        if self.missing_prob:
+            temps[self.rng.random(n) < self.missing_prob] = np.nan
+        return temps.astype(np.float32), times.astype(np.int32), overflow
+
+    def readings(self, ch, times):
+        # temperatures of channel ch at device times in ms
+        n = len(times)
+        temps = fake_temperature_data(times / 1000) - 2 * (ch - 1)
+        if self.noise == "gaussian":
+            temps += self.rng.normal(0, self.noise_std, n)
+        elif self.noise == "drift":
+            walk = np.cumsum(self.rng.normal(0, self.noise_std / 10, n))
+            temps += self._drift.get(ch, 0.0) + walk
+            if n:
+                self._drift[ch] = self._drift.get(ch, 0.0) + walk[-1]
+        return temps
+
+    def get_single(self):
+        if self.samp_int:
+            raise DeviceError("TC-08 error: unit is streaming")
+        if self.speed:
+            # conversion time of the enabled channels
+            time.sleep(self.get_minimum_interval_ms() / 1000 / self.speed)
+        temp = np.full(9, np.nan)
+        temp[0] = 25.0
+        times = np.array([self.elapsed_ms()])
+        for ch in self.channels:
+            if self.rng.random() >= self.missing_prob:
+                temp[ch] = self.readings(ch, times)[0]
+        return temp.astype(np.float32), 0
+
+    def stop(self) -> None:
+        self.samp_int = None
+
+    def close_unit(self) -> None:
+        self.handle = 0
+
+
+class ReplayDevice(SimulatedDevice):
+    # plays a saved session back as a TC-08 streaming its readings, on the
+    # SimulatedDevice clock (speed 0 only advances through advance()); each
+    # reading is the recorded one nearest its time, NaN where the session has
+    # none within half an interval
+    def __init__(self, time, temps, interval_ms, speed=0.0) -> None:
+        # temps by channel number, recorded at the elapsed times time in s
+        super().__init__(speed=speed, noise="none", min_interval_ms=interval_ms)
+        self.time = np.asarray(time, dtype=float)
+        self.temps = {ch: np.asarray(temp, dtype=float) for ch, temp in temps.items()}
+        self.half = interval_ms / 2000
+
+    def set_channel(self, ch, tc_type) -> None:
+        if ch not in self.temps:
+            raise DeviceError(f"TC-08 error: channel {ch} not in the session")
+        self.channels.add(ch)
+
+    def readings(self, ch, times):
+        t = times / 1000
+        i = np.searchsorted(self.time, t + self.half, "right") - 1
+        near = (i >= 0) & (t - self.time[np.maximum(i, 0)] < self.half)
+        return np.where(near, self.temps[ch][np.maximum(i, 0)], np.nan)
+
+    def finished(self) -> bool:
+        # whether the device clock has passed the end of the session
+        end = self.time[-1] if len(self.time) else -np.inf
+        return self.elapsed_ms() / 1000 > end + self.half
+
+
+def open_units(devices=None, max_units=MAX_UNITS):
+    # opens the given devices, or every TC-08 connected; sorted by serial number
+    # so unit numbers stay the same across runs, [] if no unit was found
+    opened = []
+    if devices is not None:
+        max_units = len(devices)
+    try:
+        while len(opened) < max_units:
+            device = devices[len(opened)] if devices is not None else PicoDevice()
+            handle = device.open_unit()
+            if handle == 0:
+                break
+            if handle < 0:
+                raise DeviceError(f"TC-08 error: {device.get_last_error()}")
+            opened.append(device)
+    except DeviceError:
+        for device in opened:
+            device.close_unit()
+        raise
+    return sorted(opened, key=lambda device: device.serial())
+
+
+def fake_temperature_data(time):
+    # heating up from room temperature to 150 degC over a few minutes
+    return 150 - np.exp((290 - np.asarray(time, dtype=float)) / 60)
@@ -0,0 +1,44 @@
+from PyQt5 import QtCore
+
+import metrics
+import time
+
+PLOT_SECONDS = metrics.histogram(
+    "tc08_plot_seconds", "Time to update the plot curves for one frame"
+)
+
+
+class DisplayScheduler(QtCore.QObject):
+    # repaints at most max_fps times per second, merging every change since the
+    # last frame into one setData per curve and skipping hidden curves/windows
+    MAX_FPS = 10
+
+    def __init__(self, window, max_fps=MAX_FPS, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.window = window
+        self.dirty = set()
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.frame)
+        self.set_max_fps(max_fps)
+        self.timer.start()
+
+    def set_max_fps(self, max_fps) -> None:
+        self.max_fps = max_fps
+        self.timer.setInterval(max(int(1000 / max_fps), 1))
+
+    def mark_dirty(self, curves=None) -> None:
+        if curves is None:
+            curves = range(len(self.window.curves))
+        self.dirty.update(curves)
+
+    def frame(self) -> None:
+        if not self.dirty or self.window.isMinimized() or not self.window.isVisible():
+            return
+        # curves hidden from the legend stay dirty until they are shown again
+        curves = self.window.curves
+        ready = {i for i in self.dirty if i < len(curves) and curves[i].isVisible()}
+        self.dirty = {i for i in self.dirty if i < len(curves)} - ready
+        if ready:
+            t0 = time.perf_counter()
+            self.window.refresh_curves(ready)
+            PLOT_SECONDS.observe(time.perf_counter() - t0)
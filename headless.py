@@ -0,0 +1,408 @@
+from acquisition import CONSUME_SECONDS, MODES, AcquisitionGroup
+from aggregate import Aggregates
+from alerts import RULE_DEFAULTS, AlertAggregator, AlertEngine
+from concurrent.futures import ThreadPoolExecutor
+from device import (
+    THERMOCOUPLE,
+    DeviceError,
+    SimulatedDevice,
+    channel_id,
+    channel_label,
+    open_units,
+)
+from mailer import Mailer
+from metrics import MetricsServer
+from os import makedirs
+from os.path import expanduser, join, splitext
+from publish import DROP_POLICIES, FORMATS, Publisher
+from session import (
+    BINARY_EXT,
+    BinarySessionWriter,
+    RotatingSessionWriter,
+    SessionWriter,
+    channel_names,
+    format_header,
+    now,
+    parse_header,
+)
+
+import argparse
+import numpy as np
+import signal
+import sys
+import threading
+import time
+
+
+class HeadlessLogger:
+    # the acquisition -> session -> alert pipeline of the GUI without Qt
+    DEFAULT_CONFIG = {
+        "save_dir": expanduser(join("~", "Documents", "tc08")),
+        "samp_int": 500,
+        "mode": "stream",
+        "therm": list(THERMOCOUPLE).index("K"),
+        "channels": {},
+        "mail": [],
+    }
+    # False leaves polling the devices to the caller through worker.read(),
+    # e.g. a replay clocking them by hand
+    threaded = True
+
+    def __init__(
+        self,
+        config,
+        devices,
+        mailer=None,
+        binary=False,
+        notifier_args=(),
+        publish=None,
+        rotation=None,
+    ) -> None:
+        self.config = config
+        # by unit number, channels are (unit, channel) ids
+        self.devices = devices
+        self.mailer = mailer
+        self.binary = binary
+        self.notifier_args = notifier_args
+        # Publisher keyword arguments (address, fmt, drop), None to not publish
+        self.publish = publish
+        # RotatingSessionWriter keyword arguments, None for one file per session
+        self.rotation = rotation
+        self.selected_ch = sorted(ch for ch, c in config["channels"].items() if c["on"])
+        self.ch_names = channel_names(config)
+        # one mail at a time, mirroring the blocking QThreadPool of the GUI
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.worker = None
+        self.writer = None
+        self.aggregates = None
+        self.publisher = None
+
+    def start(self) -> None:
+        if not self.selected_ch:
+            raise ValueError("no channel selected")
+        self.alerts = AlertEngine.from_config(self.config)
+        self.notifier = AlertAggregator(self.alerts.ch_names, *self.notifier_args)
+        notify = not np.isnan(self.alerts.threshold.level).all()
+        if notify and not (self.mailer and self.config["mail"]):
+            raise ValueError(
+                "Please enter mailling list or remove temperature notifications"
+            )
+
+        tc_type = THERMOCOUPLE[list(THERMOCOUPLE)[self.config["therm"]]]
+        missing = [ch for ch in self.selected_ch if ch[0] not in self.devices]
+        if missing:
+            labels = ", ".join(channel_label(ch) for ch in missing)
+            raise ValueError(f"channels {labels} are on units not connected")
+        self.worker = AcquisitionGroup(
+            self.devices,
+            self.selected_ch,
+            tc_type,
+            self.config["samp_int"],
+            self.config["mode"],
+        )
+        self.run_samp_int = self.worker.configure()
+        print(f"sampling at {self.run_samp_int} ms ({self.config['mode']})")
+
+        makedirs(self.config["save_dir"], exist_ok=True)
+        header = format_header(self.config)
+        ext = BINARY_EXT if self.binary else ".csv"
+        path = join(self.config["save_dir"], now() + ext)
+        if self.rotation:
+            self.writer = RotatingSessionWriter(
+                path, header, self.ch_names, **self.rotation
+            )
+        elif self.binary:
+            self.writer = BinarySessionWriter(path, header, self.ch_names)
+        else:
+            self.writer = SessionWriter(path, header, self.ch_names)
+        print(f"logging to {self.writer.path}")
+        self.aggregates = Aggregates(
+            len(self.selected_ch), splitext(path)[0], header, self.ch_names
+        )
+        if self.publish:
+            self.publisher = Publisher(
+                header=header, ch_names=self.ch_names, **self.publish
+            )
+            print(f"publishing to {self.publish['address']}")
+
+        if self.mailer and self.config["mail"]:
+            self.mailer.mail_new(mailto=self.config["mail"])
+            if notify:
+                self.mail("Logging started")
+        if self.threaded:
+            self.worker.start()
+
+    def clock(self) -> float:
+        # s, paces alert mails; a replay runs them on session time instead
+        return time.monotonic()
+
+    def poll(self) -> None:
+        self.mail(self.notifier.poll(self.clock()))
+        time_block, temp_block = self.worker.drain()
+        if time_block is None:
+            return
+        t0 = time.perf_counter()
+        self.writer.write(time_block, temp_block)
+        self.aggregates.update(time_block, temp_block)
+        if self.publisher:
+            self.publisher.publish(time_block, temp_block)
+
+        for alert in self.alerts.process(time_block, temp_block):
+            self.alert(alert)
+        CONSUME_SECONDS.observe(time.perf_counter() - t0)
+
+    def alert(self, alert) -> None:
+        print(alert.msg)
+        self.notifier.add(alert, self.clock())
+
+    def mail(self, msg) -> None:
+        if msg and self.mailer and self.config["mail"]:
+            self.pool.submit(self.mail_send, msg)
+
+    def mail_send(self, msg) -> None:
+        try:
+            self.mailer.mail_new()
+            self.mailer.mail_body(msg)
+            self.mailer.mail_send()
+        except Exception as e:
+            print(f"Mail not sent: {e}")
+
+    def stop(self) -> None:
+        if self.worker:
+            self.worker.stop()
+            self.poll()
+            self.worker = None
+        if self.writer:
+            self.writer.close()
+            print(f"saved {self.writer.rows_written} samples to {self.writer.path}")
+            self.writer = None
+            self.aggregates.close()
+            summary = self.aggregates.summary(self.ch_names)
+            print(summary)
+            if self.publisher:
+                self.publisher.close()
+                self.publisher = None
+            pending = self.notifier.flush(self.clock())
+            self.mail("\n\n".join(filter(None, ["Logging ended", summary, pending])))
+        self.pool.shutdown(wait=True)
+        if self.mailer:
+            self.mailer.close()
+
+
+def load_config(args):
+    config = dict(HeadlessLogger.DEFAULT_CONFIG, channels={}, mail=[])
+    if args.config:
+        header = []
+        with open(args.config, "r") as f:
+            for line in f:
+                if not line.startswith("#"):
+                    break
+                header.append(line.rstrip("\n"))
+        config.update(parse_header(header))
+    if args.save_dir:
+        config["save_dir"] = args.save_dir
+    if args.interval is not None:
+        config["samp_int"] = args.interval
+    if args.mode:
+        config["mode"] = args.mode
+    if args.thermocouple:
+        config["therm"] = list(THERMOCOUPLE).index(args.thermocouple)
+    if args.channels:
+        for ch_config in config["channels"].values():
+            ch_config["on"] = False
+        for ch in args.channels:
+            name = f"Ch. {channel_label(ch)}"
+            config["channels"].setdefault(ch, {"notify": "", "name": name})
+            config["channels"][ch]["on"] = True
+    for ch, temp in args.notify or []:
+        name = f"Ch. {channel_label(ch)}"
+        config["channels"].setdefault(ch, {"on": True, "name": name})
+        config["channels"][ch]["notify"] = temp
+    for ch, key, value in args.rule or []:
+        default = {"on": True, "notify": "", "name": f"Ch. {channel_label(ch)}"}
+        config["channels"].setdefault(ch, default)
+        config["channels"][ch][key] = value
+    if args.mail:
+        config["mail"] = args.mail
+    return config
+
+
+def parse_notify(value):
+    ch, temp = value.rsplit(":", 1)
+    float(temp)
+    return channel_id(ch), temp
+
+
+def parse_rule(value):
+    ch, setting = value.rsplit(":", 1)
+    key, value = setting.split("=")
+    if key not in RULE_DEFAULTS:
+        raise ValueError(f"unknown rule setting {key}")
+    return channel_id(ch), key, value
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Log TC-08 temperatures without the GUI. Options override the "
+        "config file, which uses the # header format of saved sessions."
+    )
+    parser.add_argument("--config", help="config file or saved session")
+    parser.add_argument(
+        "-c",
+        "--channels",
+        type=lambda s: [channel_id(ch) for ch in s.split(",")],
+        help="comma separated channels, e.g. 1,3,5, or 2:1 for channel 1 of unit 2",
+    )
+    parser.add_argument("-t", "--thermocouple", choices=list(THERMOCOUPLE))
+    parser.add_argument("-i", "--interval", type=int, help="sampling interval in ms")
+    parser.add_argument(
+        "--mode",
+        choices=MODES,
+        help="stream buffered readings, or read all channels in one call per "
+        "interval (fewer USB transfers at slow intervals)",
+    )
+    parser.add_argument("-d", "--save-dir")
+    parser.add_argument("-m", "--mail", nargs="+", help="mail addresses")
+    parser.add_argument(
+        "-n",
+        "--notify",
+        type=parse_notify,
+        action="append",
+        help="CH:TEMP notification temperature, repeatable",
+    )
+    parser.add_argument(
+        "-r",
+        "--rule",
+        type=parse_rule,
+        action="append",
+        help=f"CH:KEY=VALUE alert rule setting, KEY one of {', '.join(RULE_DEFAULTS)}",
+    )
+    parser.add_argument(
+        "--coalesce",
+        type=float,
+        default=AlertAggregator.WINDOW,
+        help="s to collect alerts into one mail",
+    )
+    parser.add_argument(
+        "--channel-interval",
+        type=float,
+        default=AlertAggregator.CH_INTERVAL,
+        help="minimum s between mails about the same channel",
+    )
+    parser.add_argument(
+        "--mail-interval",
+        type=float,
+        default=AlertAggregator.MAIL_INTERVAL,
+        help="minimum s between mails",
+    )
+    parser.add_argument(
+        "--publish", help="stream the session to subscribers at host:port or a path"
+    )
+    parser.add_argument("--publish-format", choices=FORMATS, default="line")
+    parser.add_argument(
+        "--publish-drop",
+        choices=DROP_POLICIES,
+        default="oldest",
+        help="what to do when a subscriber falls behind",
+    )
+    parser.add_argument(
+        "--rotate-hours", type=float, help="start a new segment file every N hours"
+    )
+    parser.add_argument(
+        "--rotate-mb", type=float, help="start a new segment file at N MB"
+    )
+    parser.add_argument(
+        "--no-compress", action="store_true", help="keep closed segments uncompressed"
+    )
+    parser.add_argument(
+        "--metrics-port", type=int, help="serve Prometheus metrics on localhost:PORT"
+    )
+    parser.add_argument("--smtp-config", default="smtp_config.txt")
+    parser.add_argument("--binary", action="store_true", help=f"save as {BINARY_EXT}")
+    parser.add_argument(
+        "--simulate",
+        nargs="?",
+        type=int,
+        const=1,
+        metavar="UNITS",
+        help="use simulated TC-08s, one unless UNITS is given",
+    )
+    args = parser.parse_args(argv)
+    config = load_config(args)
+
+    mailer = None
+    if config["mail"]:
+        try:
+            mailer = Mailer(
+                f"Temperature Notification @ {now().split('-')[0]}",
+                "",
+                "TC-08",
+                smtp_config=args.smtp_config,
+            )
+        except OSError:
+            print(
+                "Check the README for more information on configuring the SMTP server."
+            )
+            return 1
+
+    devices = None
+    if args.simulate:
+        devices = [SimulatedDevice() for _ in range(args.simulate)]
+    try:
+        devices = dict(enumerate(open_units(devices), 1))
+    except DeviceError as e:
+        print(e)
+        return 1
+    if not devices:
+        print("TC-08 not found. Please reconnect and try again.")
+        return 1
+    for unit, device in devices.items():
+        print(f"unit {unit}: {device.serial()}")
+        device.set_mains(0)
+
+    if args.metrics_port is not None:
+        try:
+            MetricsServer(args.metrics_port)
+        except OSError as e:
+            print(f"Metrics endpoint not started: {e}")
+
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+    notifier_args = (args.coalesce, args.channel_interval, args.mail_interval)
+    publish = None
+    if args.publish:
+        publish = {
+            "address": args.publish,
+            "fmt": args.publish_format,
+            "drop": args.publish_drop,
+        }
+    rotation = None
+    if args.rotate_hours or args.rotate_mb:
+        rotation = {
+            "max_seconds": args.rotate_hours and args.rotate_hours * 3600,
+            "max_bytes": args.rotate_mb and args.rotate_mb * 2**20,
+            "compress": not args.no_compress,
+        }
+    logger = HeadlessLogger(
+        config, devices, mailer, args.binary, notifier_args, publish, rotation
+    )
+    try:
+        logger.start()
+        while not stop.wait(logger.worker.poll_int / 1000):
+            if not logger.worker.is_alive():
+                return 1
+            logger.poll()
+    except (ValueError, OSError) as e:
+        print(e)
+        return 1
+    finally:
+        logger.stop()
+        for device in devices.values():
+            device.close_unit()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,11 +3,31 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.application import MIMEApplication
 
+import metrics
+import queue
 import smtplib
 import ssl
+import threading
+import time
+
+MAIL_QUEUE = metrics.gauge("tc08_mail_queue_length", "Mails waiting to be delivered")
+MAIL_LATENCY = metrics.histogram(
+    "tc08_mail_latency_seconds", "Time from queueing a mail to its delivery"
+)
+MAILS = metrics.counter("tc08_mails_total", "Mails by outcome, sent or dropped")
 
 
 class Mailer:
+    # connects lazily, checks the connection before each delivery and
+    # reconnects with exponential backoff; mail_send only queues the mail so
+    # that callers never wait on the network
+    QUEUE_LEN = 32
+    RETRIES = 5
+    BACKOFF = 1  # s, doubled after every failed attempt
+    TIMEOUT = 30  # s
+    server = None
+    sender = None
+
     def __init__(
         self, subj, mailto, mailfrom_alias=None, smtp_config="smtp_config.txt"
     ) -> None:
@@ -16,41 +36,144 @@ class Mailer:
             with open(smtp_config) as f:
                 lines = f.readlines()
                 for line in lines:
-                    k, v = line.split(":")
-                    self.smtp_config[k] = v.strip()
+                    if line.strip():
+                        k, v = line.split(":", 1)
+                        self.smtp_config[k.strip()] = v.strip()
         except OSError as e:
             print(f"To initialize SMTP client, please check if {smtp_config} exists.")
             raise e
 
+        self.queue = queue.Queue(self.QUEUE_LEN)
+        self.lock = threading.Lock()
+        self.closing = threading.Event()
         if self.smtp_config:
-            context = ssl.create_default_context()
             try:
-                self.server = smtplib.SMTP(
-                    self.smtp_config["host"], self.smtp_config["port"]
-                )
-                self.server.starttls(context=context)
-                self.server.login(
-                    self.smtp_config["user"], self.smtp_config["password"]
-                )
                 self.mail = MIMEMultipart()
                 self.mail_new(subj, mailto, mailfrom_alias or self.smtp_config["user"])
             except Exception as e:
                 print(self.smtp_config)
                 raise e
 
-    def mail_send(self) -> None:
-        # assume smtp user is sender
-        self.server.sendmail(
-            self.smtp_config["user"], self.mailto, self.written_mail.as_string()
+    def connect(self) -> None:
+        self.disconnect()
+        server = smtplib.SMTP(
+            self.smtp_config["host"], self.smtp_config["port"], timeout=self.TIMEOUT
         )
+        # "tls:no" and leaving out the password allow plain local relays
+        if self.smtp_config.get("tls", "yes").lower() != "no":
+            server.starttls(context=ssl.create_default_context())
+        if "password" in self.smtp_config:
+            server.login(self.smtp_config["user"], self.smtp_config["password"])
+        self.server = server
+
+    def disconnect(self) -> None:
+        if self.server:
+            try:
+                self.server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.server = None
+
+    def healthy(self) -> bool:
+        if not self.server:
+            return False
+        try:
+            return self.server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def deliver(self, mail, mailto) -> bool:
+        # assume smtp user is sender
+        delay = self.BACKOFF
+        for attempt in range(self.RETRIES):
+            try:
+                if not self.healthy():
+                    self.connect()
+                self.server.sendmail(self.smtp_config["user"], mailto, mail.as_string())
+                return True
+            except (smtplib.SMTPException, OSError) as e:
+                print(f"Mail attempt {attempt + 1}/{self.RETRIES} failed: {e}")
+                self.disconnect()
+                if attempt + 1 < self.RETRIES and not self.closing.wait(delay):
+                    delay *= 2
+                elif self.closing.is_set():
+                    break
+        print(f"Mail to {', '.join(mailto)} dropped: {mail['Subject']}")
+        MAILS.inc(status="dropped")
+        return False
+
+    def mail_send(self) -> None:
+        mailto = list(getattr(self, "mailto", []))
+        if not mailto:
+            print("Mail dropped, mailing list is empty")
+            return
+        with self.lock:
+            if not (self.sender and self.sender.is_alive()):
+                self.closing.clear()
+                self.sender = threading.Thread(target=self.send_loop, daemon=True)
+                self.sender.start()
+        try:
+            self.queue.put_nowait((self.written_mail, mailto, time.monotonic()))
+        except queue.Full:
+            print("Mail dropped, send queue is full")
+            MAILS.inc(status="dropped")
+        MAIL_QUEUE.set(self.queue.qsize())
+
+    def send_loop(self) -> None:
+        while True:
+            item = self.queue.get()
+            MAIL_QUEUE.set(self.queue.qsize())
+            try:
+                if item is None:
+                    break
+                mail, mailto, queued = item
+                if self.deliver(mail, mailto):
+                    MAIL_LATENCY.observe(time.monotonic() - queued)
+                    MAILS.inc(status="sent")
+            except Exception as e:
+                print(f"Mail not sent: {e}")
+                MAILS.inc(status="dropped")
+            finally:
+                self.queue.task_done()
+
+    def close(self, timeout=TIMEOUT) -> None:
+        # deliver what is queued within timeout, without backing off for
+        # retries, then hang up; if the queue is still full by then, e.g. while
+        # the server is unreachable, the queued mails are dropped
+        if self.sender and self.sender.is_alive():
+            deadline = time.monotonic() + timeout
+            self.closing.set()
+            try:
+                self.queue.put(None, timeout=timeout)
+            except queue.Full:
+                while True:
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    self.queue.task_done()
+                    if item is not None:
+                        print(f"Mail dropped on close: {item[0]['Subject']}")
+                        MAILS.inc(status="dropped")
+                try:
+                    self.queue.put_nowait(None)
+                except queue.Full:
+                    pass  # refilled meanwhile, the sender is a daemon thread
+                MAIL_QUEUE.set(self.queue.qsize())
+            self.sender.join(max(deadline - time.monotonic(), 0))
+        self.disconnect()
 
     def mail_new(self, subj=None, mailto=None, mailfrom_alias=None) -> None:
+        # headers are replaced, assigning to a message would add duplicates
         if subj:
+            del self.mail["Subject"]
             self.mail["Subject"] = subj
         if mailto:
+            del self.mail["To"]
             self.mail["To"] = ", ".join(mailto)
             self.mailto = mailto
         if mailfrom_alias:
+            del self.mail["From"]
             self.mail["From"] = mailfrom_alias
 
         self.written_mail = deepcopy(self.mail)
@@ -62,3 +185,16 @@ class Mailer:
         attachment = MIMEApplication(bytearray)
         attachment.add_header("Content-Disposition", "attachment", filename=filename)
         self.written_mail.attach(attachment)
+
+
+class LocalMailer(Mailer):
+    # keeps composed mails in memory instead of sending them, for benchmarks,
+    # tests and replays without an SMTP server
+    def __init__(self, subj, mailto, mailfrom_alias=None) -> None:
+        self.smtp_config = {"user": "tc08@localhost"}
+        self.sent = []
+        self.mail = MIMEMultipart()
+        self.mail_new(subj, mailto, mailfrom_alias or self.smtp_config["user"])
+
+    def mail_send(self) -> None:
+        self.sent.append(self.written_mail)
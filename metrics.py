@@ -0,0 +1,175 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import bisect
+import math
+import threading
+
+# s, covering sub-millisecond ticks up to stalled mails
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+BUCKETS += (5, 10, 30, 60)
+
+
+class Metric:
+    # one value per label set, labels passed as keyword arguments
+    TYPE = None
+
+    def __init__(self, name, help) -> None:
+        self.name = name
+        self.help = help
+        self.lock = threading.Lock()
+        self.values = {}
+
+    @staticmethod
+    def key(labels):
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def value(self, **labels):
+        return self.values.get(self.key(labels), 0)
+
+    def total(self):
+        return sum(self.values.values())
+
+    def samples(self):
+        # (suffix, labels, value) in exposition order
+        with self.lock:
+            return [("", key, value) for key, value in sorted(self.values.items())]
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def inc(self, amount=1, **labels) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    TYPE = "gauge"
+
+    def set(self, value, **labels) -> None:
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+    # cumulative bucket counts, sum and count per label set, plus the latest
+    # observation for the status bar
+    TYPE = "histogram"
+
+    def __init__(self, name, help, buckets=BUCKETS) -> None:
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels) -> None:
+        key = self.key(labels)
+        with self.lock:
+            if key not in self.values:
+                # bucket counts, sum, count, latest
+                self.values[key] = [[0] * len(self.buckets), 0.0, 0, None]
+            entry = self.values[key]
+            i = bisect.bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+            entry[3] = value
+
+    def value(self, **labels):
+        # (sum, count)
+        entry = self.values.get(self.key(labels))
+        return (entry[1], entry[2]) if entry else (0.0, 0)
+
+    def latest(self, **labels):
+        entry = self.values.get(self.key(labels))
+        return entry[3] if entry else None
+
+    def total(self):
+        return sum(entry[2] for entry in list(self.values.values()))
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total, count, _) in sorted(self.values.items()):
+                cumulative = 0
+                for le, n in zip(self.buckets, counts):
+                    cumulative += n
+                    samples.append(("_bucket", key + (("le", f"{le:g}"),), cumulative))
+                samples.append(("_bucket", key + (("le", "+Inf"),), count))
+                samples.append(("_sum", key, total))
+                samples.append(("_count", key, count))
+        return samples
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics = {}
+
+    def register(self, metric):
+        # modules reloaded or imported twice share the existing metric
+        return self.metrics.setdefault(metric.name, metric)
+
+    def exposition(self) -> str:
+        # Prometheus text format 0.0.4
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.TYPE}")
+            for suffix, key, value in metric.samples():
+                labels = ",".join(f'{k}="{v}"' for k, v in key)
+                labels = f"{{{labels}}}" if labels else ""
+                lines.append(f"{metric.name}{suffix}{labels} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def format_value(value) -> str:
+    if isinstance(value, float) and math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return f"{value:g}" if isinstance(value, float) else str(value)
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help) -> Counter:
+    return REGISTRY.register(Counter(name, help))
+
+
+def gauge(name, help) -> Gauge:
+    return REGISTRY.register(Gauge(name, help))
+
+
+def histogram(name, help, buckets=BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, buckets))
+
+
+class MetricsServer:
+    # serves the registry at http://host:port/metrics on a daemon thread
+    def __init__(self, port, host="127.0.0.1", registry=REGISTRY) -> None:
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.exposition().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
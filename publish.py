@@ -0,0 +1,254 @@
+from session import binary_header, record_dtype
+
+import collections
+import csv
+import io
+import metrics
+import numpy as np
+import os
+import selectors
+import socket
+import threading
+import time
+
+FORMATS = ("line", "binary")
+DROP_POLICIES = ("oldest", "disconnect")
+
+SUBSCRIBERS = metrics.gauge("tc08_subscribers", "Connected live data subscribers")
+DROPPED_ROWS = metrics.counter(
+    "tc08_publish_dropped_rows_total", "Rows dropped for slow subscribers"
+)
+
+
+def parse_address(address):
+    # "host:port" or a bare port for TCP (localhost), a path for a Unix socket
+    address = str(address)
+    if os.sep in address or (os.altsep and os.altsep in address):
+        return socket.AF_UNIX, address
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+class Subscriber:
+    def __init__(self, sock, greeting) -> None:
+        self.sock = sock
+        # the greeting is never dropped so every stream starts with a header
+        self.current = memoryview(greeting)
+        self.frames = collections.deque()  # (rows, bytes) waiting to be sent
+        self.queued = 0
+        self.dropped = 0
+        self.overrun = False
+        self.events = 0
+
+    def pending(self) -> bool:
+        return bool(self.current) or bool(self.frames)
+
+
+class Publisher:
+    # streams every acquired block to any number of local subscribers, in the
+    # session's CSV layout ("line") or its .tcb record layout ("binary"); each
+    # subscriber has a bounded queue served by one selector thread, so a slow
+    # client loses data (or its connection) but never blocks acquisition
+    BUFFER_BYTES = 1 << 20
+
+    def __init__(
+        self,
+        address,
+        header,
+        ch_names,
+        fmt="line",
+        drop="oldest",
+        buffer_bytes=BUFFER_BYTES,
+    ) -> None:
+        if fmt not in FORMATS:
+            raise ValueError(f"format must be one of {FORMATS}")
+        if drop not in DROP_POLICIES:
+            raise ValueError(f"drop policy must be one of {DROP_POLICIES}")
+        self.fmt = fmt
+        self.drop = drop
+        self.buffer_bytes = buffer_bytes
+        self.dropped_rows = 0
+        if fmt == "binary":
+            self.dtype = record_dtype(len(ch_names))
+            self.greeting = binary_header(header, ch_names)
+        else:
+            self.greeting = self.encode_lines(
+                [["Elapsed time (s)"] + list(ch_names)], header
+            )
+
+        family, self.address = parse_address(address)
+        self.server = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_UNIX:
+            if os.path.exists(self.address):
+                os.unlink(self.address)
+        else:
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(self.address)
+        self.server.listen()
+        self.server.setblocking(False)
+
+        self.lock = threading.Lock()
+        self.subscribers = {}
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.server, selectors.EVENT_READ)
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self.selector.register(self._wake_r, selectors.EVENT_READ)
+        self._deadline = None
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def encode_lines(rows, header=()) -> bytes:
+        f = io.StringIO(newline="")
+        f.writelines(line + "\n" for line in header)
+        csv.writer(f).writerows(rows)
+        return f.getvalue().encode("utf-8")
+
+    def encode(self, time_block, temp_block) -> bytes:
+        if self.fmt == "binary":
+            records = np.empty(len(time_block), self.dtype)
+            records["time"] = time_block
+            records["temp"] = temp_block.T
+            return records.tobytes()
+        return self.encode_lines(zip(time_block.tolist(), *temp_block.tolist()))
+
+    def publish(self, time_block, temp_block) -> None:
+        # called from the acquisition consumer, only encodes and enqueues
+        if not self.subscribers or not len(time_block):
+            return
+        frame = self.encode(time_block, temp_block)
+        with self.lock:
+            for sub in self.subscribers.values():
+                while sub.frames and sub.queued + len(frame) > self.buffer_bytes:
+                    if self.drop == "disconnect":
+                        sub.frames.clear()
+                        sub.queued = 0
+                        sub.overrun = True
+                        break
+                    rows, old = sub.frames.popleft()
+                    sub.queued -= len(old)
+                    sub.dropped += rows
+                    self.dropped_rows += rows
+                    DROPPED_ROWS.inc(rows)
+                if not sub.overrun:
+                    sub.frames.append((len(time_block), frame))
+                    sub.queued += len(frame)
+        self.wake()
+
+    def wake(self) -> None:
+        try:
+            self._wake_w.send(b"\0")
+        except BlockingIOError:
+            pass  # already woken
+
+    def serve(self) -> None:
+        while self._deadline is None or (
+            time.monotonic() < self._deadline
+            and any(sub.pending() for sub in list(self.subscribers.values()))
+        ):
+            self.update_events()
+            timeout = None if self._deadline is None else 0.05
+            for key, events in self.selector.select(timeout):
+                if key.fileobj is self.server:
+                    self.accept()
+                elif key.fileobj is self._wake_r:
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                else:
+                    sub = self.subscribers.get(key.fileobj)
+                    if sub is None:
+                        continue
+                    if events & selectors.EVENT_READ and not self.receive(sub):
+                        continue
+                    if events & selectors.EVENT_WRITE:
+                        self.send(sub)
+
+    def update_events(self) -> None:
+        with self.lock:
+            subs = list(self.subscribers.values())
+        for sub in subs:
+            if sub.overrun:
+                self.disconnect(sub)
+                continue
+            events = selectors.EVENT_READ
+            if sub.pending():
+                events |= selectors.EVENT_WRITE
+            if events != sub.events:
+                self.selector.modify(sub.sock, events)
+                sub.events = events
+
+    def accept(self) -> None:
+        try:
+            sock, _ = self.server.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        sub = Subscriber(sock, self.greeting)
+        sub.events = selectors.EVENT_READ | selectors.EVENT_WRITE
+        self.selector.register(sock, sub.events)
+        with self.lock:
+            self.subscribers[sock] = sub
+            SUBSCRIBERS.set(len(self.subscribers))
+
+    def receive(self, sub) -> bool:
+        # subscribers only listen, anything they send is discarded
+        try:
+            if sub.sock.recv(4096):
+                return True
+        except BlockingIOError:
+            return True
+        except OSError:
+            pass
+        self.disconnect(sub)
+        return False
+
+    def send(self, sub) -> None:
+        while True:
+            if not sub.current:
+                with self.lock:
+                    if not sub.frames or sub.overrun:
+                        return
+                    _, frame = sub.frames.popleft()
+                    sub.queued -= len(frame)
+                    if sub.dropped and self.fmt == "line":
+                        frame = f"#Dropped {sub.dropped}\n".encode() + frame
+                    sub.dropped = 0
+                    sub.current = memoryview(frame)
+            try:
+                n = sub.sock.send(sub.current)
+            except BlockingIOError:
+                return
+            except OSError:
+                self.disconnect(sub)
+                return
+            sub.current = sub.current[n:]
+
+    def disconnect(self, sub) -> None:
+        with self.lock:
+            self.subscribers.pop(sub.sock, None)
+            SUBSCRIBERS.set(len(self.subscribers))
+        try:
+            self.selector.unregister(sub.sock)
+        except (KeyError, ValueError):
+            pass
+        sub.sock.close()
+
+    def close(self, timeout=1.0) -> None:
+        # subscribers get up to timeout s to receive what is queued, then see
+        # the end of the stream
+        self._deadline = time.monotonic() + timeout
+        self.wake()
+        self.thread.join()
+        for sub in list(self.subscribers.values()):
+            self.disconnect(sub)
+        self.selector.close()
+        self.server.close()
+        self._wake_r.close()
+        self._wake_w.close()
+        if self.server.family == socket.AF_UNIX and os.path.exists(self.address):
+            os.unlink(self.address)
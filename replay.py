@@ -0,0 +1,227 @@
+from alerts import AlertAggregator, AlertEngine
+from collections import Counter
+from device import ReplayDevice, channel_label
+from headless import HeadlessLogger, parse_notify, parse_rule
+from mailer import LocalMailer
+from session import channel_names, parse_header, read_session
+
+import argparse
+import csv
+import mailbox
+import numpy as np
+import sys
+import tempfile
+import time
+
+
+def load_session(path, notify=(), rules=()):
+    # (config, time, temp) of a saved session with its notification
+    # temperatures and rule settings overridden by (ch, temp) and (ch, key, value)
+    header, _, time_data, temp_data = read_session(path)
+    config = parse_header(header)
+    settings = [(ch, "notify", temp) for ch, temp in notify] + list(rules)
+    for ch, key, value in settings:
+        if not config["channels"].get(ch, {}).get("on"):
+            raise ValueError(f"channel {channel_label(ch)} is not in the session")
+        config["channels"][ch][key] = value
+    return config, time_data, np.asarray(temp_data, dtype=float)
+
+
+def backtest(config, time_data, temp_data):
+    # every alert the rules of config raise over the whole session, evaluated
+    # as a single block, i.e. one vectorized pass per rule
+    return AlertEngine.from_config(config).process(time_data, temp_data)
+
+
+def interval_ms(config, time_data) -> int:
+    # the interval actually sampled at, the unit may have raised the setting
+    if len(time_data) > 1:
+        return max(int(np.rint(np.median(np.diff(time_data)) * 1000)), 1)
+    return config["samp_int"]
+
+
+def replay_devices(config, time_data, temp_data, speed=0.0):
+    # a ReplayDevice per unit of the session, by unit
+    channels = sorted(ch for ch, c in config["channels"].items() if c["on"])
+    interval = interval_ms(config, time_data)
+    temps = {}
+    for (unit, ch), temp in zip(channels, temp_data):
+        temps.setdefault(unit, {})[ch] = temp
+    return {
+        unit: ReplayDevice(time_data, unit_temps, interval, speed)
+        for unit, unit_temps in temps.items()
+    }
+
+
+class ReplayLogger(HeadlessLogger):
+    # the headless acquisition -> alert -> notification pipeline fed by
+    # ReplayDevices, with alert mails paced by session time and captured by a
+    # LocalMailer; speed 0 clocks the devices by hand as fast as they are read
+    STEP = 1.0  # s, default session time per manual read, well below mail pacing
+
+    def __init__(self, config, devices, notifier_args=(), speed=0.0) -> None:
+        config = dict(config, mode="stream", mail=config["mail"] or ["replay"])
+        mailer = LocalMailer("Replay", config["mail"])
+        super().__init__(config, devices, mailer, notifier_args=notifier_args)
+        self.threaded = speed > 0
+        self.device = devices[min(devices)]
+        self.fired = []  # alerts in the order they fired
+        self.mails = []  # (session time, body) in the order they were sent
+
+    def clock(self) -> float:
+        return self.device.elapsed_ms() / 1000
+
+    def alert(self, alert) -> None:
+        self.fired.append(alert)
+        super().alert(alert)
+
+    def mail(self, msg) -> None:
+        if msg:
+            self.mails.append((self.clock(), msg))
+        super().mail(msg)
+
+    def run(self, step=None) -> None:
+        # until every device has played its whole session; a manual step is in
+        # s of session time
+        self.start()
+        try:
+            poll_s = self.worker.poll_int / 1000
+            # a step may not overrun the device buffer
+            max_step = (ReplayDevice.BUFFER_LEN - 1) * self.run_samp_int / 1000
+            step = min(step or max(poll_s, self.STEP), max_step)
+            while not all(device.finished() for device in self.devices.values()):
+                if self.threaded:
+                    time.sleep(poll_s)
+                    if not self.worker.is_alive():
+                        raise RuntimeError(f"replay stopped: {self.worker.error}")
+                else:
+                    for device in self.devices.values():
+                        device.advance(step)
+                    self.worker.read()
+                self.poll()
+        finally:
+            self.stop()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Replay a saved session through the alert rules, optionally "
+        "with other notification temperatures and rule settings. Mails are "
+        "captured, never sent."
+    )
+    parser.add_argument("session", help="saved session, any segment of a rotated one")
+    parser.add_argument(
+        "-n",
+        "--notify",
+        type=parse_notify,
+        action="append",
+        help="CH:TEMP notification temperature, repeatable",
+    )
+    parser.add_argument(
+        "-r",
+        "--rule",
+        type=parse_rule,
+        action="append",
+        help="CH:KEY=VALUE alert rule setting, repeatable",
+    )
+    parser.add_argument(
+        "--vectorized",
+        action="store_true",
+        help="evaluate the rules over the whole session in one pass and list every "
+        "alert instead of replaying the pipeline",
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=0,
+        help="replay at N times real time, 0 (default) as fast as possible",
+    )
+    parser.add_argument(
+        "--step",
+        type=float,
+        help="s of session time per read when replaying as fast as possible "
+        f"(default {ReplayLogger.STEP:g}), larger is faster but paces mails more "
+        "coarsely",
+    )
+    parser.add_argument(
+        "--coalesce",
+        type=float,
+        default=AlertAggregator.WINDOW,
+        help="s to collect alerts into one mail",
+    )
+    parser.add_argument(
+        "--channel-interval",
+        type=float,
+        default=AlertAggregator.CH_INTERVAL,
+        help="minimum s between mails about the same channel",
+    )
+    parser.add_argument(
+        "--mail-interval",
+        type=float,
+        default=AlertAggregator.MAIL_INTERVAL,
+        help="minimum s between mails",
+    )
+    parser.add_argument(
+        "-d", "--save-dir", help="keep the replayed session here, by default discarded"
+    )
+    parser.add_argument("--mbox", help="also append the captured mails to this mbox")
+    parser.add_argument("-o", "--output", help="write the alerts to this CSV file")
+    args = parser.parse_args(argv)
+
+    try:
+        config, time_data, temp_data = load_session(
+            args.session, args.notify or [], args.rule or []
+        )
+    except (OSError, ValueError) as e:
+        print(e)
+        return 1
+    if not len(time_data):
+        print(f"{args.session} has no readings")
+        return 1
+
+    t0 = time.perf_counter()
+    if args.vectorized:
+        alerts = backtest(config, time_data, temp_data)
+        ch_names = channel_names(config)
+        for alert in alerts:
+            print(f"[{alert.time:.1f} s] {alert.msg}")
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config["save_dir"] = args.save_dir or tmp_dir
+            devices = replay_devices(config, time_data, temp_data, args.speed)
+            notifier_args = (args.coalesce, args.channel_interval, args.mail_interval)
+            logger = ReplayLogger(config, devices, notifier_args, args.speed)
+            try:
+                # alerts are printed by the pipeline as they fire
+                logger.run(args.step)
+            except (ValueError, RuntimeError) as e:
+                print(e)
+                return 1
+        alerts, ch_names = logger.fired, logger.ch_names
+        for sent, body in logger.mails:
+            print(f"\nMail at {sent:.1f} s:\n{body}")
+        if args.mbox:
+            box = mailbox.mbox(args.mbox)
+            for mail in logger.mailer.sent:
+                box.add(mail)
+            box.close()
+    seconds = time.perf_counter() - t0
+
+    counts = Counter(alert.ch for alert in alerts)
+    summary = ", ".join(f"{ch_names[ch]} x{n}" for ch, n in sorted(counts.items()))
+    span = time_data[-1] - time_data[0]
+    print(
+        f"\n{len(alerts)} alerts{': ' + summary if summary else ''}; "
+        f"{span:.0f} s of session in {seconds:.2f} s"
+    )
+    if args.output:
+        with open(args.output, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["Elapsed time (s)", "Channel", "Alert"])
+            for alert in alerts:
+                writer.writerow([alert.time, ch_names[alert.ch], alert.msg])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,526 @@
+from alerts import RULE_DEFAULTS
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from device import channel_id, channel_label
+
+import csv
+import glob
+import gzip
+import metrics
+import numpy as np
+import os
+import re
+import shutil
+import struct
+import time
+import warnings
+
+
+SESSION_BYTES = metrics.counter("tc08_session_bytes_total", "Bytes written to sessions")
+
+
+class SessionWriter:
+    # journals a session to disk as it is acquired: the "#" configuration header
+    # is written on open, sample blocks are appended through the file buffer and
+    # fsync'ed periodically so an interrupted run leaves a readable file behind
+    FSYNC_INT = 10  # s
+
+    def __init__(self, path, header, ch_names, fsync_int=FSYNC_INT) -> None:
+        self.path = path
+        self.fsync_int = fsync_int
+        self.rows_written = 0
+        self.f = open(path, "w", newline="")
+        self.f.writelines(line + "\n" for line in header)
+        self.writer = csv.writer(self.f)
+        self.writer.writerow(["Elapsed time (s)"] + list(ch_names))
+        self.bytes_written = 0
+        self.sync()
+
+    def write(self, time_block, temp_block) -> None:
+        self.writer.writerows(zip(time_block.tolist(), *temp_block.tolist()))
+        self.rows_written += len(time_block)
+        self.count_bytes()
+        if time.monotonic() - self._last_sync >= self.fsync_int:
+            self.sync()
+
+    def count_bytes(self) -> None:
+        size = self.f.tell()
+        SESSION_BYTES.inc(size - self.bytes_written)
+        self.bytes_written = size
+
+    def sync(self) -> None:
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self._last_sync = time.monotonic()
+
+    def close(self) -> None:
+        if not self.f.closed:
+            self.sync()
+            self.f.close()
+
+
+def now() -> str:
+    return datetime.now().strftime("%Y%m%d-%H%M%S")
+
+
+def parse_header(lines):
+    # configuration held in the "#" header of a session or config file
+    config = {"channels": {}, "mail": []}
+    for line in lines:
+        if "#Dir" in line:
+            config["save_dir"] = line.split()[1]
+        elif "#Samp" in line:
+            config["samp_int"] = int(line.rsplit(maxsplit=1)[1])
+        elif "#Mode" in line:
+            config["mode"] = line.split()[1]
+        elif "#Therm" in line:
+            config["therm"] = int(line.rsplit(maxsplit=1)[1])
+        elif "#Ch" in line:
+            elem = line.split(maxsplit=3)
+            dlg_config = elem[2]
+            if dlg_config[0] == "/":
+                # channel off /->
+                on, notify = False, dlg_config[3:]
+            else:
+                # channel on ->
+                on, notify = True, dlg_config[2:]
+            config["channels"].setdefault(channel_id(elem[1]), {}).update(
+                on=on, notify=notify, name=elem[-1].strip()
+            )
+        elif "#Rule" in line:
+            # alert rule settings as key=value pairs, blank values turn a rule off
+            elem = line.split()
+            rules = dict(kv.split("=", 1) for kv in elem[2:])
+            config["channels"].setdefault(channel_id(elem[1]), {}).update(rules)
+        elif "#Mail " in line:
+            config["mail"] = line[6:].split()
+    return config
+
+
+def format_header(config):
+    header = [
+        "# Configurations",
+        f"#Dir {config['save_dir']}",
+        f"#Samp {config['samp_int']}",
+        f"#Mode {config['mode']}",
+        f"#Therm {config['therm']}",
+    ]
+    for ch, ch_config in sorted(config["channels"].items()):
+        # channels as (unit, channel) ids, "3" or "2:3" in the header
+        label = channel_label(ch)
+        off = "" if ch_config["on"] else "/"
+        header.append(f"#Ch {label} {off}->{ch_config['notify']} {ch_config['name']}")
+        rules = [f"{k}={v}" for k, v in ch_config.items() if k in RULE_DEFAULTS]
+        if rules:
+            header.append(f"#Rule {label} {' '.join(rules)}")
+    header.append(f"#Mail {' '.join(config['mail'])}")
+    header.append("#")
+    header.append("#" * 30)
+    return header
+
+
+def channel_names(config):
+    return [c["name"] for _, c in sorted(config["channels"].items()) if c["on"]]
+
+
+BINARY_EXT = ".tcb"
+BINARY_MAGIC = b"TC08SES1"
+BINARY_ALIGN = 16
+CHUNK_BYTES = 1 << 24
+# every byte but the CSV separators, deleted to check the fields of each line
+NOT_SEPARATORS = bytes(sorted(set(range(256)) - set(b",\n")))
+
+# rotated sessions are split into {stem}.001.csv, {stem}.002.csv, ... (or .tcb)
+# and closed segments are gzip-compressed to {stem}.001.csv.gz
+GZIP_EXT = ".gz"
+SEGMENT_RE = re.compile(r"^(?P<stem>.*)\.(?P<n>\d{3,})(?P<ext>\.csv|\.tcb)(\.gz)?$")
+
+
+class BinarySessionWriter(SessionWriter):
+    # same header metadata as the CSV, followed by fixed-width records of a
+    # float64 time column and one float32/float64 column per channel
+    def __init__(
+        self, path, header, ch_names, fsync_int=SessionWriter.FSYNC_INT, dtype="<f4"
+    ) -> None:
+        self.path = path
+        self.fsync_int = fsync_int
+        self.rows_written = 0
+        self.dtype = record_dtype(len(ch_names), dtype)
+        self.f = open(path, "wb")
+        self.f.write(binary_header(header, ch_names, dtype))
+        self.bytes_written = 0
+        self.sync()
+
+    def write(self, time_block, temp_block) -> None:
+        records = np.empty(len(time_block), self.dtype)
+        records["time"] = time_block
+        records["temp"] = temp_block.T
+        self.f.write(records.tobytes())
+        self.rows_written += len(records)
+        self.count_bytes()
+        if time.monotonic() - self._last_sync >= self.fsync_int:
+            self.sync()
+
+
+def record_dtype(n_ch, dtype="<f4") -> np.dtype:
+    return np.dtype([("time", "<f8"), ("temp", dtype, (n_ch,))])
+
+
+def binary_header(header, ch_names, dtype="<f4") -> bytes:
+    # magic, header length, channel count, sample width, then the "#" lines and
+    # column names as text, padded so that the records start aligned
+    text = "\n".join(list(header) + [",".join(["Elapsed time (s)"] + list(ch_names))])
+    text = text.encode("utf-8")
+    prefix_len = len(BINARY_MAGIC) + 8
+    pad = -(prefix_len + len(text)) % BINARY_ALIGN
+    prefix = BINARY_MAGIC + struct.pack(
+        "<IHH", len(text) + pad, len(ch_names), np.dtype(dtype).itemsize
+    )
+    return prefix + text + b"\n" * pad
+
+
+def read_binary_header(path):
+    with open_session_file(path, "rb") as f:
+        return parse_binary_header(f, path)
+
+
+def parse_binary_header(f, path):
+    # leaves f at the first record
+    magic = f.read(len(BINARY_MAGIC))
+    if magic != BINARY_MAGIC:
+        raise ValueError(f"{path} is not a TC-08 binary session")
+    text_len, n_ch, width = struct.unpack("<IHH", f.read(8))
+    text = f.read(text_len).decode("utf-8").rstrip("\n").split("\n")
+    offset = len(BINARY_MAGIC) + 8 + text_len
+    ch_names = next(csv.reader(text[-1:]))[1:]
+    return text[:-1], ch_names, offset, record_dtype(n_ch, f"<f{width}")
+
+
+def open_session_file(path, mode="r"):
+    # plain or gzip-compressed (rotated segments) session file
+    if path.endswith(GZIP_EXT):
+        return gzip.open(path, mode + "t" if mode == "r" else mode)
+    return open(path, mode)
+
+
+def select_rows(time_data, start=0, stride=1, t_range=None):
+    # slice of the rows kept by a partial load, rows numbered from start
+    lo, hi = 0, len(time_data)
+    if t_range is not None:
+        lo = np.searchsorted(time_data, t_range[0], side="left")
+        hi = np.searchsorted(time_data, t_range[1], side="right")
+    lo += (-(start + lo)) % stride
+    return slice(lo, hi, stride)
+
+
+def read_binary(path, stride=1, t_range=None):
+    # memory-mapped, time and temp are views into the file and nothing is copied
+    return _read_binary(path, stride, t_range)[:4]
+
+
+def _read_binary(path, stride=1, t_range=None, start=0):
+    # also returns the number of records in the file, rows numbered from start
+    if path.endswith(GZIP_EXT):
+        with gzip.open(path, "rb") as f:
+            header, ch_names, _, dtype = parse_binary_header(f, path)
+            data = f.read()
+        records = np.frombuffer(data, dtype, len(data) // dtype.itemsize)
+    else:
+        header, ch_names, offset, dtype = read_binary_header(path)
+        n = (os.path.getsize(path) - offset) // dtype.itemsize
+        if n:
+            records = np.memmap(path, dtype, "r", offset, (n,))
+        else:
+            records = np.empty(0, dtype)
+    n = len(records)
+    records = records[select_rows(records["time"], start, stride, t_range)]
+    return header, ch_names, records["time"], records["temp"].T, n
+
+
+def parse_block(text, n_col) -> np.ndarray:
+    # text holds complete lines only, parsed in one C-level pass once every line
+    # has n_col fields, a total alone would let malformed lines shift columns
+    n_row = text.count("\n")
+    seps = text.encode().translate(None, NOT_SEPARATORS)
+    if seps == (b"," * (n_col - 1) + b"\n") * n_row:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", DeprecationWarning)
+            values = np.fromstring(text[:-1].replace("\n", ","), dtype=float, sep=",")
+        if values.size == n_row * n_col:
+            return values.reshape(n_row, n_col)
+    # malformed rows, e.g. from an interrupted run, fall back to the csv module
+    rows = [r for r in csv.reader(text.splitlines()) if len(r) == n_col]
+    return np.array(rows, dtype=float).reshape(-1, n_col)
+
+
+def read_csv(path, stride=1, t_range=None, chunk_bytes=CHUNK_BYTES):
+    # the numeric block after the "#" header is parsed chunk by chunk straight
+    # into arrays, keeping every stride-th row and/or rows within t_range
+    return _read_csv(path, stride, t_range, chunk_bytes)[:4]
+
+
+def parse_csv_header(f):
+    # "#" lines and channel names, leaves f at the first row
+    header = []
+    line = f.readline()
+    while line.startswith("#"):
+        header.append(line.rstrip("\n"))
+        line = f.readline()
+    ch_names = next(csv.reader([line]))[1:] if line.strip() else []
+    return header, ch_names
+
+
+def csv_blocks(f, n_col, chunk_bytes=CHUNK_BYTES):
+    # parsed (rows, n_col) blocks of complete lines from f onwards
+    tail = ""
+    while True:
+        text = f.read(chunk_bytes)
+        if not text:
+            # a remaining tail is a torn last line of an interrupted run
+            break
+        text = tail + text
+        cut = text.rfind("\n") + 1
+        text, tail = text[:cut], text[cut:]
+        if text:
+            yield parse_block(text, n_col)
+
+
+def _read_csv(path, stride=1, t_range=None, chunk_bytes=CHUNK_BYTES, start=0):
+    # also returns the number of rows parsed, rows numbered from start
+    with open_session_file(path) as f:
+        header, ch_names = parse_csv_header(f)
+        n_col = len(ch_names) + 1
+
+        blocks = []
+        n_read = start
+        for block in csv_blocks(f, n_col, chunk_bytes):
+            blocks.append(block[select_rows(block[:, 0], n_read, stride, t_range)])
+            n_read += len(block)
+            if t_range is not None and len(block) and block[-1, 0] > t_range[1]:
+                break
+
+    data = np.concatenate(blocks) if blocks else np.empty((0, n_col))
+    data = np.ascontiguousarray(data.T)
+    return header, ch_names, data[0], data[1:], n_read - start
+
+
+def read_session(path, stride=1, t_range=None):
+    # a rotated session is read from all of its segments, given any of them
+    paths = session_segments(path)
+    if not paths:
+        raise FileNotFoundError(f"No session at {path}")
+    parts = []
+    start = 0
+    for segment in paths:
+        if BINARY_EXT in os.path.basename(segment):
+            part = _read_binary(segment, stride, t_range, start)
+        else:
+            part = _read_csv(segment, stride, t_range, start=start)
+        parts.append(part)
+        start += part[4]
+        if t_range is not None and len(part[2]) and part[2][-1] >= t_range[1]:
+            break
+    header, ch_names, time_data, temp_data, _ = parts[0]
+    if len(parts) > 1:
+        time_data = np.concatenate([part[2] for part in parts])
+        temp_data = np.concatenate([part[3] for part in parts], axis=1)
+    return header, ch_names, time_data, temp_data
+
+
+def read_session_header(path):
+    # (header, ch_names) of a session file or segment
+    if BINARY_EXT in os.path.basename(path):
+        return read_binary_header(path)[:2]
+    with open_session_file(path) as f:
+        return parse_csv_header(f)
+
+
+def segment_blocks(path, chunk_bytes=CHUNK_BYTES, offset=None):
+    # (start, end, time, temp) blocks of one session file, start and end being
+    # the file offsets of the block's rows; reading starts at offset if given,
+    # the start of a row, e.g. the end of a block read before
+    binary = BINARY_EXT in os.path.basename(path)
+    with open_session_file(path, "rb") as f:
+        if binary:
+            dtype = parse_binary_header(f, path)[3]
+        else:
+            line = f.readline()
+            while line.startswith(b"#"):
+                line = f.readline()
+            n_col = len(next(csv.reader([line.decode("utf-8")]), []))
+        if offset is not None:
+            f.seek(offset)
+        start = f.tell()
+        if binary:
+            n = max(chunk_bytes // dtype.itemsize, 1)
+            while True:
+                data = f.read(n * dtype.itemsize)
+                records = np.frombuffer(data, dtype, len(data) // dtype.itemsize)
+                if not len(records):
+                    # a partial record is the torn end of an interrupted run
+                    break
+                end = start + records.nbytes
+                yield start, end, records["time"], records["temp"].T
+                start = end
+        else:
+            tail = b""
+            while True:
+                data = f.read(chunk_bytes)
+                if not data:
+                    break
+                data = tail + data
+                cut = data.rfind(b"\n") + 1
+                data, tail = data[:cut], data[cut:]
+                if data:
+                    block = parse_block(data.decode("utf-8").replace("\r", ""), n_col)
+                    end = start + len(data)
+                    yield start, end, block[:, 0], block[:, 1:].T
+                    start = end
+
+
+def iter_session(path, chunk_bytes=CHUNK_BYTES):
+    # (header, ch_names, blocks) of a session given any of its segments, blocks
+    # yields (time, temp) chunk by chunk so any length is read in bounded memory
+    paths = session_segments(path)
+    if not paths:
+        raise FileNotFoundError(f"No session at {path}")
+    header, ch_names = read_session_header(paths[0])
+
+    def blocks():
+        for segment in paths:
+            for _, _, time_block, temp_block in segment_blocks(segment, chunk_bytes):
+                yield time_block, temp_block
+
+    return header, ch_names, blocks()
+
+
+def segment_path(stem, n, ext) -> str:
+    return f"{stem}.{n:03d}{ext}"
+
+
+def session_segments(path):
+    # all segment files of the session path belongs to in order, [path] for an
+    # unrotated session and [] if there is none; a segment being compressed is
+    # read from its uncompressed original, which is only removed afterwards
+    match = SEGMENT_RE.match(path)
+    if not match:
+        return [path] if os.path.exists(path) else []
+    stem, ext = match["stem"], match["ext"]
+    segments = {}
+    for candidate in glob.glob(glob.escape(stem) + ".*" + ext + "*"):
+        m = SEGMENT_RE.match(candidate)
+        if m and m["stem"] == stem and m["ext"] == ext:
+            n = int(m["n"])
+            if n not in segments or not candidate.endswith(GZIP_EXT):
+                segments[n] = candidate
+    return [segments[n] for n in sorted(segments)]
+
+
+def compress_file(path) -> str:
+    # gzip path next to it and remove the original once the copy is complete
+    tmp = path + GZIP_EXT + ".tmp"
+    with open(path, "rb") as src, open(tmp, "wb") as raw:
+        with gzip.GzipFile(os.path.basename(path), "wb", fileobj=raw) as dst:
+            shutil.copyfileobj(src, dst, CHUNK_BYTES)
+    os.replace(tmp, path + GZIP_EXT)
+    os.remove(path)
+    return path + GZIP_EXT
+
+
+class RotatingSessionWriter:
+    # journals a session into numbered segments that each start with the full
+    # "#" header, moving on to the next one every max_seconds of session time
+    # and/or once a segment reaches max_bytes; closed segments are compressed
+    # one at a time on a background thread
+    def __init__(
+        self,
+        path,
+        header,
+        ch_names,
+        max_seconds=None,
+        max_bytes=None,
+        compress=True,
+        fsync_int=SessionWriter.FSYNC_INT,
+    ) -> None:
+        self.stem, self.ext = os.path.splitext(path)
+        self.writer_cls = (
+            BinarySessionWriter if self.ext == BINARY_EXT else SessionWriter
+        )
+        self.header = header
+        self.ch_names = ch_names
+        self.max_seconds = max_seconds
+        self.max_bytes = max_bytes
+        self.fsync_int = fsync_int
+        self.pool = ThreadPoolExecutor(max_workers=1) if compress else None
+        self.rows_written = 0
+        self.n = 0
+        self.open_segment()
+        # the first segment names the session, e.g. in last_opened.txt
+        self.path = self.writer.path
+
+    def open_segment(self) -> None:
+        self.n += 1
+        self.writer = self.writer_cls(
+            segment_path(self.stem, self.n, self.ext),
+            self.header,
+            self.ch_names,
+            self.fsync_int,
+        )
+
+    def write(self, time_block, temp_block) -> None:
+        if not len(time_block):
+            return
+        self.writer.write(time_block, temp_block)
+        self.rows_written += len(time_block)
+        due = self.max_seconds and time_block[-1] >= self.n * self.max_seconds
+        if due or (self.max_bytes and self.writer.f.tell() >= self.max_bytes):
+            self.rotate()
+
+    def rotate(self) -> None:
+        self.close_segment()
+        self.open_segment()
+
+    def close_segment(self) -> None:
+        self.writer.close()
+        if self.pool:
+            self.pool.submit(compress_file, self.writer.path)
+
+    def sync(self) -> None:
+        self.writer.sync()
+
+    def close(self, wait=False) -> None:
+        # compression continues in the background (and before exit) unless wait
+        if not self.writer.f.closed:
+            self.close_segment()
+        if self.pool:
+            self.pool.shutdown(wait=wait)
+
+
+def csv_to_binary(csv_path, bin_path, dtype="<f4") -> None:
+    header, ch_names, time_data, temp_data = read_csv(csv_path)
+    writer = BinarySessionWriter(bin_path, header, ch_names, dtype=dtype)
+    writer.write(time_data, temp_data)
+    writer.close()
+
+
+def binary_to_csv(bin_path, csv_path) -> None:
+    header, ch_names, time_data, temp_data = read_binary(bin_path)
+    writer = SessionWriter(csv_path, header, ch_names)
+    writer.write(time_data, temp_data.astype(float))
+    writer.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Convert TC-08 sessions between CSV and binary format"
+    )
+    parser.add_argument("src")
+    parser.add_argument("dst")
+    parser.add_argument("--double", action="store_true", help="store float64 samples")
+    args = parser.parse_args()
+    if args.src.endswith(BINARY_EXT):
+        binary_to_csv(args.src, args.dst)
+    else:
+        csv_to_binary(args.src, args.dst, "<f8" if args.double else "<f4")
@@ -0,0 +1,188 @@
+from PyQt5 import QtCore, QtGui
+
+import numpy as np
+import pyqtgraph as pg
+import threading
+
+# elapsed time tick steps in s, above these multiples of a day
+TIME_STEPS = [1, 2, 5, 10, 15, 30, 60, 120, 300, 600, 900, 1800, 3600, 7200, 21600]
+
+
+def nice_step(span, n_ticks, steps=None):
+    # smallest step of 1, 2 or 5 times a power of ten (or from steps) giving at
+    # most n_ticks intervals over span
+    raw = span / max(n_ticks, 1)
+    if steps:
+        for step in steps:
+            if step >= raw:
+                return step
+        return 86400 * nice_step(raw / 86400, 1)
+    scale = 10 ** np.floor(np.log10(raw)) if raw > 0 else 1
+    for m in (1, 2, 5, 10):
+        if m * scale >= raw:
+            return m * scale
+    return 10 * scale
+
+
+def format_elapsed(seconds) -> str:
+    h, rest = divmod(int(round(seconds)), 3600)
+    return f"{h}:{rest // 60:02d}:{rest % 60:02d}"
+
+
+class Snapshot:
+    # downsampled copy of the session taken in the GUI thread, rendered to PNG
+    # at most once with QPainter on a QImage, which unlike the live plot widget
+    # may be drawn from the mail thread
+    def __init__(self, time, temp, names, colors, size) -> None:
+        self.time = time
+        self.temp = temp
+        self.names = names
+        self.colors = colors
+        self.width, self.height = size
+        self._png = None
+        self._lock = threading.Lock()
+
+    def png(self) -> bytes:
+        with self._lock:
+            if self._png is None:
+                f = QtCore.QBuffer()
+                f.open(QtCore.QBuffer.ReadWrite)
+                self.render().save(f, "PNG")
+                self._png = bytes(f.data())
+                f.close()
+            return self._png
+
+    def render(self) -> QtGui.QImage:
+        img = QtGui.QImage(self.width, self.height, QtGui.QImage.Format_RGB32)
+        img.fill(QtCore.Qt.white)
+        painter = QtGui.QPainter(img)
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+        try:
+            self.draw(painter)
+        finally:
+            painter.end()
+        return img
+
+    def draw(self, painter) -> None:
+        metrics = painter.fontMetrics()
+        line_h = metrics.height()
+        left, right = 8 * metrics.averageCharWidth() + line_h, 15
+        top, bottom = line_h, 3 * line_h
+        plot = QtCore.QRectF(
+            left, top, self.width - left - right, self.height - top - bottom
+        )
+
+        finite = np.isfinite(self.temp)
+        if not len(self.time) or not finite.any():
+            painter.drawText(plot, QtCore.Qt.AlignCenter, "No data")
+            return
+        x0, x1 = float(self.time[0]), float(self.time[-1])
+        y0, y1 = float(self.temp[finite].min()), float(self.temp[finite].max())
+        if x1 <= x0:
+            x0, x1 = x0 - 1, x1 + 1
+        pad = (y1 - y0) * 0.05 or 1
+        y0, y1 = y0 - pad, y1 + pad
+
+        def to_x(x):
+            return plot.left() + (x - x0) / (x1 - x0) * plot.width()
+
+        def to_y(y):
+            return plot.bottom() - (y - y0) / (y1 - y0) * plot.height()
+
+        # grid and tick labels
+        grid = QtGui.QPen(QtGui.QColor(0, 0, 0, 50))
+        n_ticks = plot.width() / (10 * metrics.averageCharWidth())
+        step = nice_step(x1 - x0, n_ticks, TIME_STEPS)
+        for x in np.arange(np.ceil(x0 / step) * step, x1 + step / 2, step):
+            px = to_x(x)
+            painter.setPen(grid)
+            painter.drawLine(
+                QtCore.QPointF(px, plot.top()), QtCore.QPointF(px, plot.bottom())
+            )
+            painter.setPen(QtCore.Qt.black)
+            label = QtCore.QRectF(px - 50, plot.bottom() + 2, 100, line_h)
+            painter.drawText(label, QtCore.Qt.AlignHCenter, format_elapsed(x))
+        step = nice_step(y1 - y0, plot.height() / (2 * line_h))
+        for y in np.arange(np.ceil(y0 / step) * step, y1, step):
+            py = to_y(y)
+            painter.setPen(grid)
+            painter.drawLine(
+                QtCore.QPointF(plot.left(), py), QtCore.QPointF(plot.right(), py)
+            )
+            painter.setPen(QtCore.Qt.black)
+            label = QtCore.QRectF(0, py - line_h / 2, plot.left() - 4, line_h)
+            align = QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter
+            painter.drawText(label, align, f"{y:g}")
+        painter.drawRect(plot)
+        painter.drawText(
+            QtCore.QRectF(plot.left(), self.height - line_h - 2, plot.width(), line_h),
+            QtCore.Qt.AlignHCenter,
+            "Time",
+        )
+        painter.save()
+        painter.translate(line_h, plot.center().y())
+        painter.rotate(-90)
+        painter.drawText(
+            QtCore.QRectF(-plot.height() / 2, -line_h, plot.height(), line_h),
+            QtCore.Qt.AlignHCenter,
+            "Temperature (\u2103)",
+        )
+        painter.restore()
+
+        # curves, broken at gaps; min/max pairs zigzag densely, which is several
+        # times slower to stroke antialiased for no visible gain
+        painter.setClipRect(plot)
+        painter.setRenderHint(QtGui.QPainter.Antialiasing, False)
+        px = to_x(np.asarray(self.time, dtype=float))
+        for temp, color in zip(self.temp, self.colors):
+            painter.setPen(pg.mkPen(color, width=2))
+            path = pg.arrayToQPath(px, to_y(np.asarray(temp, dtype=float)), "finite")
+            painter.drawPath(path)
+        painter.setClipping(False)
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+
+        # legend
+        width = max(metrics.horizontalAdvance(name) for name in self.names) + 40
+        height = line_h * len(self.names) + 8
+        box = QtCore.QRectF(plot.right() - width - 10, plot.top() + 10, width, height)
+        painter.setPen(QtGui.QColor(0, 0, 0, 100))
+        painter.setBrush(QtGui.QColor(255, 255, 255, 200))
+        painter.drawRect(box)
+        for i, (name, color) in enumerate(zip(self.names, self.colors)):
+            y = box.top() + 4 + (i + 0.5) * line_h
+            painter.setPen(pg.mkPen(color, width=3))
+            painter.drawLine(
+                QtCore.QPointF(box.left() + 6, y), QtCore.QPointF(box.left() + 26, y)
+            )
+            painter.setPen(QtCore.Qt.black)
+            painter.drawText(
+                QtCore.QRectF(box.left() + 32, y - line_h / 2, width - 32, line_h),
+                QtCore.Qt.AlignVCenter,
+                name,
+            )
+
+
+class SnapshotRenderer:
+    # hands out one Snapshot per data version, so alerts raised together share
+    # a single downsampling and render
+    SIZE = (1000, 500)
+
+    def __init__(self, size=SIZE) -> None:
+        self.size = size
+        self.key = None
+        self.snapshot = None
+
+    def capture(self, pyramid, names, colors) -> Snapshot:
+        # GUI thread only, the arrays are copied before leaving it
+        store = pyramid.store
+        key = (store.version, tuple(names), tuple(colors))
+        if key != self.key:
+            if len(store):
+                time, temp = pyramid.view(store.time[0], store.time[-1], self.size[0])
+            else:
+                time, temp = store.time, store.temp
+            self.snapshot = Snapshot(
+                np.array(time), np.array(temp), list(names), list(colors), self.size
+            )
+            self.key = key
+        return self.snapshot
@@ -0,0 +1,142 @@
+import itertools
+import numpy as np
+
+# data versions are unique across stores so caches can key on them alone
+_versions = itertools.count()
+
+
+class SampleStore:
+    # time and all channel temperatures in preallocated arrays, grown by doubling
+    # so that appending a block is amortized O(1) instead of copying the history
+    MIN_CAPACITY = 4096
+
+    def __init__(self, n_ch, capacity=MIN_CAPACITY, dtype=float) -> None:
+        self.n_ch = n_ch
+        self.size = 0
+        self.version = next(_versions)
+        capacity = max(int(capacity), 1)
+        self._time = np.empty(capacity, dtype=float)
+        self._temp = np.empty((n_ch, capacity), dtype=dtype)
+
+    @classmethod
+    def wrap(cls, time, temp) -> "SampleStore":
+        # adopt existing (e.g. memory-mapped) arrays without copying, a later
+        # append reallocates into regular memory
+        store = cls.__new__(cls)
+        store.n_ch = len(temp)
+        store.size = len(time)
+        store.version = next(_versions)
+        store._time = time
+        store._temp = temp
+        return store
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def capacity(self) -> int:
+        return len(self._time)
+
+    @property
+    def time(self) -> np.ndarray:
+        # views, valid until the next append that triggers a reallocation
+        return self._time[: self.size]
+
+    @property
+    def temp(self) -> np.ndarray:
+        return self._temp[:, : self.size]
+
+    def reserve(self, capacity) -> None:
+        if capacity <= self.capacity:
+            return
+        new_capacity = max(self.capacity, 1)
+        while new_capacity < capacity:
+            new_capacity *= 2
+        time = np.empty(new_capacity, dtype=float)
+        temp = np.empty((self.n_ch, new_capacity), dtype=self._temp.dtype)
+        time[: self.size] = self._time[: self.size]
+        temp[:, : self.size] = self._temp[:, : self.size]
+        self._time = time
+        self._temp = temp
+
+    def append(self, time, temp) -> None:
+        # time: (k,) seconds, temp: (n_ch, k)
+        time = np.atleast_1d(np.asarray(time, dtype=float))
+        k = len(time)
+        if not k:
+            return
+        self.reserve(self.size + k)
+        self._time[self.size : self.size + k] = time
+        self._temp[:, self.size : self.size + k] = np.asarray(temp).reshape(
+            self.n_ch, k
+        )
+        self.size += k
+        self.version = next(_versions)
+
+
+class MinMaxPyramid:
+    # multi-resolution min/max envelope of a SampleStore, level k holds one
+    # bucket per FACTOR**(k + 1) samples and is extended as samples arrive
+    FACTOR = 4
+    TOP_LEN = 256
+
+    def __init__(self, store, factor=FACTOR) -> None:
+        self.store = store
+        self.factor = factor
+        self.levels = []
+        self.update()
+
+    def update(self) -> None:
+        n_ch, f = self.store.n_ch, self.factor
+        src_time, src_lo, src_hi = self.store.time, self.store.temp, self.store.temp
+        k = 0
+        while True:
+            if k == len(self.levels):
+                if len(src_time) < f * self.TOP_LEN:
+                    break
+                # sized for what is there already, e.g. a whole loaded session
+                level = SampleStore(
+                    2 * n_ch, len(src_time) // f, dtype=self.store.temp.dtype
+                )
+                self.levels.append(level)
+            level = self.levels[k]
+            a, b = len(level) * f, len(src_time) // f * f
+            if b > a:
+                # fmin/fmax ignore gaps (NaN) unless the whole bucket is missing;
+                # reduced a bucket offset at a time over strided views
+                lohi = np.concatenate((src_lo[:, a:b:f], src_hi[:, a:b:f]))
+                for j in range(1, f):
+                    np.fmin(lohi[:n_ch], src_lo[:, a + j : b : f], out=lohi[:n_ch])
+                    np.fmax(lohi[n_ch:], src_hi[:, a + j : b : f], out=lohi[n_ch:])
+                level.append(src_time[a:b:f], lohi)
+            src_time, src_lo, src_hi = level.time, level.temp[:n_ch], level.temp[n_ch:]
+            k += 1
+
+    def view(self, x0, x1, width):
+        # (time, temp) to draw [x0, x1] with roughly width points per channel,
+        # from the coarsest complete buckets down to raw samples at the tail
+        n_ch = self.store.n_ch
+        time = self.store.time
+        start = max(np.searchsorted(time, x0, side="right") - 1, 0)
+        stop = min(np.searchsorted(time, x1, side="left") + 1, len(time))
+        k = 0
+        while k < len(self.levels) and (stop - start) / self.factor**k > width:
+            k += 1
+
+        xs, ys = [], []
+        for j in range(k, 0, -1):
+            level, size = self.levels[j - 1], self.factor**j
+            b0, b1 = start // size, min(len(level), -(-stop // size))
+            if b1 > b0:
+                y = np.empty((n_ch, 2 * (b1 - b0)), dtype=level.temp.dtype)
+                y[:, 0::2] = level.temp[:n_ch, b0:b1]
+                y[:, 1::2] = level.temp[n_ch:, b0:b1]
+                xs.append(np.repeat(level.time[b0:b1], 2))
+                ys.append(y)
+                start = b1 * size
+        if start < stop or not xs:
+            xs.append(time[start:stop])
+            ys.append(self.store.temp[:, start:stop])
+        if len(xs) == 1:
+            return xs[0], ys[0]
+        return np.concatenate(xs), np.concatenate(ys, axis=1)
@@ -1,19 +1,52 @@
+from acquisition import (
+    BLOCK_LATENCY,
+    CONSUME_SECONDS,
+    GAPS,
+    OVERFLOWS,
+    SAMPLES,
+    AcquisitionGroup,
+)
+from aggregate import Aggregates
+from alerts import RULE_DEFAULTS, AlertAggregator, AlertEngine
 from ast import Try
-from datetime import datetime
-from mailer import Mailer
+from catalog import Catalog, session_name
+from device import (
+    THERMOCOUPLE,
+    DeviceError,
+    SimulatedDevice,
+    channel_label,
+    open_units,
+)
+from display import PLOT_SECONDS, DisplayScheduler
+from mailer import MAIL_QUEUE, Mailer
+from metrics import MetricsServer
 from os import makedirs
 from os.path import expanduser, join, realpath, dirname, exists
-from picosdk.functions import assert_pico2000_ok
-from picosdk.usbtc08 import usbtc08 as tc08
+from publish import DROP_POLICIES, FORMATS, Publisher
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtWidgets import QApplication
-from pyqtgraph.exporters import ImageExporter
-
-import csv
-import ctypes
+from session import (
+    BINARY_EXT,
+    SESSION_BYTES,
+    GZIP_EXT,
+    BinarySessionWriter,
+    RotatingSessionWriter,
+    SessionWriter,
+    channel_names,
+    format_header,
+    now,
+    parse_header,
+    read_session,
+    session_segments,
+)
+from snapshot import SnapshotRenderer
+from store import MinMaxPyramid, SampleStore
+
+import argparse
 import numpy as np
 import pyqtgraph as pg
 import sys
+import time
 
 # Qt5.12 high DPI scaling
 QApplication.setAttribute(QtCore.Qt.AA_EnableHighDpiScaling, True)
@@ -33,64 +66,116 @@ class MainWindow(QtWidgets.QMainWindow):
         "#a65628",
         "#f781bf",
     ]
-    THERMOCOUPLE = {
-        "B": 66,
-        "E": 69,
-        "J": 74,
-        "K": 75,
-        "N": 78,
-        "R": 82,
-        "S": 83,
-        "T": 84,
-        "X": 88,
-    }
+    # channels of further units share the colors of the first, line style by unit
+    UNIT_STYLE = [
+        QtCore.Qt.SolidLine,
+        QtCore.Qt.DashLine,
+        QtCore.Qt.DotLine,
+        QtCore.Qt.DashDotLine,
+        QtCore.Qt.DashDotDotLine,
+    ]
+    THERMOCOUPLE = THERMOCOUPLE
     CONTROLS = []
-    DEV_HANDLE = 0
-    BUFFER_LEN = 1
     FILE_PATH = dirname(realpath(__file__))
 
     save_dir = expanduser(join("~", "Documents", "tc08"))
     makedirs(save_dir, exist_ok=True)
     samp_int = 500
+    # "stream" or "single", see acquisition.MODES
+    acq_mode = "stream"
+    max_fps = DisplayScheduler.MAX_FPS
 
     selected_ch = []
     started = False
-    ch_dialogs = [None] * 9
-    temp_buffer = (ctypes.c_float * BUFFER_LEN * 9)()
-    time_buffer = (ctypes.c_int32 * BUFFER_LEN)()
-    overflow = ctypes.c_int16()
+    ch_dialogs = {}
+    pyramid = None
+    aggregates = None
+    worker = None
+    writer = None
+    publisher = None
+    catalog_thread = None
+    # session rotation, 0 for no limit
+    rotate_hours = 0
+    rotate_mb = 0
+    compress = True
+    # Publisher keyword arguments (address, fmt, drop) to stream sessions live
+    publish = None
+    # port of the Prometheus metrics endpoint, None to not serve it
+    metrics_port = None
     curves = []
 
-    def __init__(self, *args, **kwargs) -> None:
+    def __init__(self, devices=None, mailer=None, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
         self.setWindowTitle("TC-08 Python Logger")
 
+        # open the given devices or every TC-08 connected, by unit number
+        self.devices = {}
+        while not self.devices:
+            try:
+                self.devices = dict(enumerate(open_units(devices), 1))
+                msg = "TC-08 not found. Please reconnect and try again."
+            except DeviceError as e:
+                msg = str(e)
+            if not self.devices:
+                msg_box = QtWidgets.QMessageBox()
+                msg_box.setWindowTitle("Device Issue")
+                msg_box.setStandardButtons(
+                    QtWidgets.QMessageBox.Retry | QtWidgets.QMessageBox.Close
+                )
+                msg_box.setText(msg)
+                if msg_box.exec() == QtWidgets.QMessageBox.Close:
+                    self.close()
+                    sys.exit(0)
+        for device in self.devices.values():
+            device.set_mains(0)
+
         # menu bar
         menu = self.menuBar()
         act = menu.addAction("&Load")
         act.setStatusTip("Load data and configuration from saved file")
         act.triggered.connect(self.load)
         self.CONTROLS.append(act)
+        act = menu.addAction("Sessi&ons")
+        act.setStatusTip("Browse, filter and open sessions in the save directory")
+        act.triggered.connect(self.browse_sessions)
+        self.CONTROLS.append(act)
         act = menu.addAction("Save &Directory")
         act.setStatusTip(f"Select save directory, currently using {self.save_dir}")
         act.triggered.connect(self.select_save_dir)
         self.CONTROLS.append(act)
         act = menu.addAction("&Sampling Interval")
-        act.setStatusTip(f"TC-08 sampling interval, currently at {self.samp_int} ms")
+        act.setStatusTip(self.samp_int_tip())
         act.triggered.connect(self.set_samp_int)
         self.CONTROLS.append(act)
+        self.binary_act = menu.addAction("&Binary Format")
+        self.binary_act.setCheckable(True)
+        self.binary_act.setStatusTip(
+            f"Save sessions as compact memory-mappable {BINARY_EXT} files"
+        )
+        self.CONTROLS.append(self.binary_act)
+        act = menu.addAction("Session &Rotation")
+        act.setStatusTip(self.rotation_tip())
+        act.triggered.connect(self.set_rotation)
+        self.CONTROLS.append(act)
         self.statusBar()
+        self.metrics_label = QtWidgets.QLabel()
+        self.statusBar().addPermanentWidget(self.metrics_label)
 
-        # channels
-        ch_layout = QtWidgets.QGridLayout()
+        # channels, one tab per unit when several are connected
         ch_label = QtWidgets.QLabel("Channels:")
-        for i, ch in enumerate(self.TC08_CH_ORDER):
-            btn = QtWidgets.QPushButton(f"{ch}")
-            btn.setCheckable(True)
-            btn.ch = ch
-            btn.clicked.connect(self.select_ch)
-            ch_layout.addWidget(btn, int(i / 2), i % 2)
-            self.CONTROLS.append(btn)
+        self.ch_btns = {}
+        ch_layouts = []
+        for unit in self.devices:
+            ch_layout = QtWidgets.QGridLayout()
+            for i, ch in enumerate(self.TC08_CH_ORDER):
+                btn = QtWidgets.QPushButton(f"{ch}")
+                btn.setCheckable(True)
+                btn.ch = (unit, ch)
+                btn.clicked.connect(self.select_ch)
+                self.ch_btns[btn.ch] = btn
+                ch_layout.addWidget(btn, int(i / 2), i % 2)
+                self.CONTROLS.append(btn)
+            ch_layouts.append(ch_layout)
 
         # thermocouple
         tc_layout = QtWidgets.QHBoxLayout()
@@ -118,7 +203,15 @@ class MainWindow(QtWidgets.QMainWindow):
         vspacing = 20
         panel_layout = QtWidgets.QVBoxLayout()
         panel_layout.addWidget(ch_label)
-        panel_layout.addLayout(ch_layout)
+        if len(ch_layouts) > 1:
+            ch_tabs = QtWidgets.QTabWidget()
+            for unit, ch_layout in zip(self.devices, ch_layouts):
+                page = QtWidgets.QWidget()
+                page.setLayout(ch_layout)
+                ch_tabs.addTab(page, f"Unit {unit}")
+            panel_layout.addWidget(ch_tabs)
+        else:
+            panel_layout.addLayout(ch_layouts[0])
         panel_layout.addSpacing(vspacing)
         panel_layout.addLayout(tc_layout)
         panel_layout.addSpacing(vspacing)
@@ -137,6 +230,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.plot_widget.setLabel("left", "Temperature (<font>&#8451;</font>)")
         self.plot_widget.setLabel("bottom", "Time")
         self.plot_widget.addLegend()
+        self.plot_widget.getViewBox().sigXRangeChanged.connect(self.view_changed)
 
         # layout
         main_widget = QtWidgets.QWidget()
@@ -148,11 +242,12 @@ class MainWindow(QtWidgets.QMainWindow):
 
         # initialize mail threadpool and makes it blocking
         self.pool = QtCore.QThreadPool()
+        self.snapshots = SnapshotRenderer()
         self.pool.setMaxThreadCount(1)
 
         # initialize mailer
         try:
-            self.mailer = Mailer(
+            self.mailer = mailer or Mailer(
                 f"Temperature Notification @ {now().split('-')[0]}", "", "TC-08"
             )
         except OSError:
@@ -166,27 +261,22 @@ class MainWindow(QtWidgets.QMainWindow):
                 self.close()
                 sys.exit(0)
 
-        # initialize plot update timer
+        # initialize acquisition drain timer and frame-rate-capped plot refresh
         self.timer = QtCore.QTimer()
         self.timer.timeout.connect(self.update_plot)
+        self.display = DisplayScheduler(self, self.max_fps)
+        self.metrics_timer = QtCore.QTimer()
+        self.metrics_timer.timeout.connect(self.update_status)
+        self.metrics_timer.start(1000)
+        self.last_samples = (time.monotonic(), SAMPLES.total())
+        self.metrics_server = None
+        if self.metrics_port is not None:
+            try:
+                self.metrics_server = MetricsServer(self.metrics_port)
+            except OSError as e:
+                print(f"Metrics endpoint not started: {e}")
 
         # finalize config initialization
-        while self.DEV_HANDLE <= 0:
-            self.DEV_HANDLE = tc08.usb_tc08_open_unit()
-            if self.DEV_HANDLE <= 0:
-                msg_box = QtWidgets.QMessageBox()
-                msg_box.setWindowTitle("Device Issue")
-                msg_box.setStandardButtons(
-                    QtWidgets.QMessageBox.Retry | QtWidgets.QMessageBox.Close
-                )
-                if self.DEV_HANDLE == 0:
-                    msg_box.setText("TC-08 not found. Please reconnect and try again.")
-                elif self.DEV_HANDLE == -1:
-                    msg_box.setText(f"TC-08 error: {tc08.usb_tc08_get_last_error(0)}")
-                if msg_box.exec() == QtWidgets.QMessageBox.Close:
-                    self.close()
-                    sys.exit(0)
-        tc08.usb_tc08_set_mains(self.DEV_HANDLE, 0)
         self.restore_last()
 
     def restore_last(self) -> None:
@@ -196,59 +286,102 @@ class MainWindow(QtWidgets.QMainWindow):
                 self.load(f.readline())
 
     def closeEvent(self, event) -> None:
-        if self.DEV_HANDLE:
-            tc08.usb_tc08_stop(self.DEV_HANDLE)
-            tc08.usb_tc08_close_unit(self.DEV_HANDLE)
+        if self.worker:
+            self.worker.stop()
+            self.update_plot()
+        if self.writer:
+            self.writer.close()
+            self.aggregates.close()
+        if self.publisher:
+            self.publisher.close()
+        for device in self.devices.values():
+            device.stop()
+            device.close_unit()
+        self.pool.waitForDone()
+        if self.catalog_thread:
+            # the index is saved whole, the dialog is not opened any more
+            self.catalog_thread.finished.disconnect()
+            self.catalog_thread.wait()
+        self.mailer.close()
+        if self.metrics_server:
+            self.metrics_server.close()
         event.accept()
 
-    def load(self, load_file=None) -> None:
+    def load(self, load_file=None, stride=1, t_range=None) -> None:
         if not load_file:
             load_file, _ = QtWidgets.QFileDialog.getOpenFileName(
                 self,
                 "Load data and config",
                 self.save_dir,
-                "Comma-Separated Values File (*.csv)",
+                f"TC-08 Session (*.csv *{BINARY_EXT} *{GZIP_EXT});;"
+                "Comma-Separated Values File (*.csv);;"
+                f"TC-08 Binary Session (*{BINARY_EXT})",
             )
-        elif not exists(load_file):
+        elif not session_segments(load_file):
             print(f"File {load_file} does not exists")
             return
 
         if load_file:
-            with open(load_file, "r") as f:
-                line = f.readline()
-                while line[0] == "#":
-                    if "#Dir" in line:
-                        prev_save_dir = line.split()[1]
-                        if exists(prev_save_dir):
-                            self.save_dir = prev_save_dir
-                    elif "#Samp" in line:
-                        self.samp_int = int(line.rsplit(maxsplit=1)[1])
-                    elif "#Therm" in line:
-                        self.tc_cb.setCurrentIndex(int(line.rsplit(maxsplit=1)[1]))
-                    elif "#Ch" in line:
-                        elem = line.split(maxsplit=3)
-                        ch = int(elem[1])
-                        dlg_config = elem[2]
-                        print(elem)
-                        if self.ch_dialogs[ch] == None:
-                            self.ch_dialogs[ch] = ChannelDialog(ch)
-                        self.ch_dialogs[ch].name_text.setText(elem[-1].strip())
-                        if dlg_config[0] == "/":
-                            # channel off /->
-                            self.ch_dialogs[ch].temp_text.setText(dlg_config[3:])
-                        else:
-                            # channel on ->
-                            self.CONTROLS[self.TC08_CH_ORDER.index(ch) + 3].toggle()
-                            self.selected_ch.append(ch)
-                            self.ch_dialogs[ch].temp_text.setText(dlg_config[2:])
-                    elif "#Mail " in line:
-                        self.mail_text.setPlainText(line[6:])
-                    line = f.readline()
-                reader = csv.reader(f)
-                data = list(zip(*reader))
-                self.time = list(np.array(data[0], dtype=float))
-                self.temp = list(np.array(data[1:], dtype=float))
-            self.init_plot()
+            # the aggregate files cover whole sessions only
+            stem = None
+            if t_range is None:
+                stem = join(dirname(load_file), session_name(load_file))
+            self.show_session(*read_session(load_file, stride, t_range), stem)
+
+    def browse_sessions(self) -> None:
+        # the catalog only reads sessions saved or changed since it was last
+        # used, still the first index of a directory takes a while and is built
+        # on its own thread; the dialog opens once the catalog is up to date
+        if self.catalog_thread and self.catalog_thread.isRunning():
+            return
+        self.catalog_thread = CatalogThread(Catalog(self.save_dir))
+        self.catalog_thread.finished.connect(self.catalog_ready)
+        self.statusBar().showMessage(f"Indexing sessions in {self.save_dir}...")
+        self.catalog_thread.start()
+
+    def catalog_ready(self) -> None:
+        self.statusBar().clearMessage()
+        catalog = self.catalog_thread.catalog
+        dlg = SessionDialog(catalog)
+        if dlg.exec() and dlg.selected():
+            key, t_range = dlg.selected()
+            stem = None
+            if t_range is None:
+                stem = join(catalog.directory, catalog.sessions[key]["name"])
+            self.show_session(*catalog.read(key, t_range), stem)
+
+    def show_session(
+        self, header, ch_names, time_data, temp_data, stem=None
+    ) -> None:
+        # given the session's stem, trends come from its saved aggregate files
+        self.load_config(parse_header(header))
+        self.store = SampleStore.wrap(time_data, temp_data)
+        self.aggregates = Aggregates.restore(stem, time_data, temp_data)
+        self.init_plot()
+
+    def load_config(self, config) -> None:
+        if exists(config.get("save_dir", "")):
+            self.save_dir = config["save_dir"]
+        if "samp_int" in config:
+            self.samp_int = config["samp_int"]
+        if "mode" in config:
+            self.acq_mode = config["mode"]
+        if "therm" in config:
+            self.tc_cb.setCurrentIndex(config["therm"])
+        for ch, ch_config in config["channels"].items():
+            if ch not in self.ch_dialogs:
+                self.ch_dialogs[ch] = ChannelDialog(ch)
+            self.ch_dialogs[ch].name_text.setText(ch_config["name"])
+            self.ch_dialogs[ch].temp_text.setText(ch_config["notify"])
+            for key, text in self.ch_dialogs[ch].rule_texts.items():
+                text.setText(ch_config.get(key, RULE_DEFAULTS[key]))
+            if ch_config["on"]:
+                # channels of units not connected are plotted but not logged
+                if ch in self.ch_btns:
+                    self.ch_btns[ch].toggle()
+                self.selected_ch.append(ch)
+        if config["mail"]:
+            self.mail_text.setPlainText(" ".join(config["mail"]))
 
     def select_save_dir(self) -> None:
         new_save_dir = QtWidgets.QFileDialog.getExistingDirectory(
@@ -277,6 +410,12 @@ class MainWindow(QtWidgets.QMainWindow):
         validator.setRange(0, np.inf)
         samp_int_text.setValidator(validator)
         layout.addWidget(samp_int_text)
+        single_box = QtWidgets.QCheckBox(
+            "Read all channels in one call per interval (fewer USB transfers "
+            "at slow intervals)"
+        )
+        single_box.setChecked(self.acq_mode == "single")
+        layout.addWidget(single_box)
 
         btn_box = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok)
         btn_box.accepted.connect(dlg.accept)
@@ -288,19 +427,74 @@ class MainWindow(QtWidgets.QMainWindow):
                 if new_samp_int:
                     self.samp_int = int(new_samp_int)
                 else:
-                    self.samp_int = tc08.usb_tc08_get_minimum_interval_ms(
-                        self.DEV_HANDLE
+                    self.samp_int = max(
+                        device.get_minimum_interval_ms()
+                        for device in self.devices.values()
                     )
-                self.sender().setStatusTip(
-                    f"TC-08 sampling interval, currently at {self.samp_int} ms"
-                )
             except ValueError:
                 pass
+            self.acq_mode = "single" if single_box.isChecked() else "stream"
+            self.sender().setStatusTip(self.samp_int_tip())
+
+    def samp_int_tip(self) -> str:
+        mode = ", single reads" if self.acq_mode == "single" else ""
+        return f"TC-08 sampling interval, currently at {self.samp_int} ms{mode}"
+
+    def rotation_tip(self) -> str:
+        if not (self.rotate_hours or self.rotate_mb):
+            return "Split long sessions into segments, currently one file per session"
+        limits = []
+        if self.rotate_hours:
+            limits.append(f"{self.rotate_hours:g} h")
+        if self.rotate_mb:
+            limits.append(f"{self.rotate_mb:g} MB")
+        limits = " or ".join(limits) + (", compressed" if self.compress else "")
+        return f"Split long sessions into segments, currently every {limits}"
+
+    def set_rotation(self) -> None:
+        layout = QtWidgets.QVBoxLayout()
+        label = QtWidgets.QLabel("Start a new segment file after (blank for no limit):")
+        layout.addWidget(label)
+
+        dlg = QtWidgets.QDialog()
+        dlg.setLayout(layout)
+        dlg.setWindowFlags(self.windowFlags() & ~QtCore.Qt.WindowContextHelpButtonHint)
+        dlg.setWindowTitle("Session Rotation")
+
+        validator = QtGui.QDoubleValidator()
+        validator.setRange(0, np.inf)
+        texts = []
+        for value, unit in [(self.rotate_hours, "hours"), (self.rotate_mb, "MB")]:
+            row_layout = QtWidgets.QHBoxLayout()
+            text = QtWidgets.QLineEdit(f"{value:g}" if value else "")
+            text.setPlaceholderText("no limit")
+            text.setValidator(validator)
+            row_layout.addWidget(text)
+            row_layout.addWidget(QtWidgets.QLabel(unit))
+            layout.addLayout(row_layout)
+            texts.append(text)
+        compress_box = QtWidgets.QCheckBox("Compress closed segments")
+        compress_box.setChecked(self.compress)
+        layout.addWidget(compress_box)
+
+        btn_box = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok)
+        btn_box.accepted.connect(dlg.accept)
+        layout.addWidget(btn_box)
+
+        if dlg.exec():
+            try:
+                self.rotate_hours, self.rotate_mb = [
+                    float(text.text() or 0) for text in texts
+                ]
+            except ValueError:
+                pass
+            self.compress = compress_box.isChecked()
+            self.sender().setStatusTip(self.rotation_tip())
 
     def select_ch(self) -> None:
         btn = self.sender()
         if btn.isChecked():
-            if self.ch_dialogs[btn.ch]:
+            if btn.ch in self.ch_dialogs:
                 dlg = self.ch_dialogs[btn.ch]
             else:
                 dlg = ChannelDialog(btn.ch)
@@ -317,32 +511,18 @@ class MainWindow(QtWidgets.QMainWindow):
 
         if not self.started:
             # start logging
-            self.notify_at = [None] * 9
-            for ch in self.selected_ch:
-                # initialize notification
-                try:
-                    self.notify_at[ch] = float(self.ch_dialogs[ch].temp_text.text())
-                except (AttributeError, ValueError) as e:
-                    pass
-
-                # initialize device
-                assert_pico2000_ok(
-                    tc08.usb_tc08_set_channel(
-                        self.DEV_HANDLE,
-                        ch,
-                        self.THERMOCOUPLE[self.tc_cb.currentText()],
-                    )
-                )
-            dev_min_int = tc08.usb_tc08_get_minimum_interval_ms(self.DEV_HANDLE)
-            new_samp_int = max(self.samp_int, dev_min_int)
-            assert_pico2000_ok(tc08.usb_tc08_run(self.DEV_HANDLE, new_samp_int))
-
-            # initialize timer
-            self.timer.setInterval(new_samp_int * self.BUFFER_LEN)
-            print(f"sampling at {new_samp_int} ms")
+            missing = [ch for ch in self.selected_ch if ch not in self.ch_btns]
+            if missing:
+                labels = ", ".join(channel_label(ch) for ch in missing)
+                print(f"Channels {labels} not connected, not logging them")
+            self.selected_ch = sorted(set(self.selected_ch) - set(missing))
             self.mail_addresses = self.mail_text.toPlainText().split()
+            self.alerts = AlertEngine.from_config(self.config())
+            self.notifier = AlertAggregator(self.alerts.ch_names)
 
-            if any(self.notify_at):
+            # notification temperatures need a mailing list, other rules only
+            # mail when there is one
+            if not np.isnan(self.alerts.threshold.level).all():
                 if self.mail_addresses:
                     self.mailer.mail_new(mailto=self.mail_addresses)
                     runnable = MailingThread(self.mailer, None, "Logging started")
@@ -357,133 +537,217 @@ class MainWindow(QtWidgets.QMainWindow):
                     self.enabled_controls(~self.started)
                     return
 
+            # initialize devices, the workers own them until stopped
+            self.worker = AcquisitionGroup(
+                self.devices,
+                self.selected_ch,
+                self.THERMOCOUPLE[self.tc_cb.currentText()],
+                self.samp_int,
+                self.acq_mode,
+            )
+            self.run_samp_int = self.worker.configure()
+            print(f"sampling at {self.run_samp_int} ms ({self.acq_mode})")
+
+            # initialize timer
+            self.timer.setInterval(self.worker.poll_int)
+
             # clear plot widget before starting
             self.plot_widget.clear()
-            self.selected_ch = sorted(self.selected_ch)
-            self.time = []
-            self.temp = []
+            self.store = SampleStore(len(self.selected_ch))
             self.init_plot()
             self.start_btn.setText("Stop")
-            self.timer.start()
             self.session_time = now()
+            self.open_session()
+            self.worker.start()
+            self.timer.start()
         else:
             # stop logging
-            self.output_csv()
-            self.start_btn.setText("Start")
             self.timer.stop()
-            runnable = MailingThread(self.mailer, self.plot_widget, "Logging ended")
+            self.worker.stop()
+            self.update_plot()
+            self.worker = None
+            self.writer.close()
+            self.writer = None
+            self.aggregates.close()
+            if self.publisher:
+                self.publisher.close()
+                self.publisher = None
+            self.start_btn.setText("Start")
+            msg = "\n\n".join(
+                filter(
+                    None,
+                    [
+                        "Logging ended",
+                        self.aggregates.summary(self.alerts.ch_names),
+                        self.notifier.flush(time.monotonic()),
+                    ],
+                )
+            )
+            runnable = MailingThread(self.mailer, self.snapshot(), msg)
             self.pool.start(runnable)
 
         self.started = ~self.started
 
     def init_plot(self) -> None:
-        # requires selected_ch, time, temp and ch_dialogs to be set
+        # requires selected_ch, store and ch_dialogs to be set
         self.curves = []
-        self.temp_buffer = (ctypes.c_float * self.BUFFER_LEN * 9)()
-        self.time_buffer = (ctypes.c_int32 * self.BUFFER_LEN)()
-        for i, ch in enumerate(self.selected_ch):
-            self.temp.append([])
-            pen = pg.mkPen(self.COLOR[ch], width=5)
+        self.pyramid = MinMaxPyramid(self.store)
+        for unit, ch in self.selected_ch:
+            style = self.UNIT_STYLE[(unit - 1) % len(self.UNIT_STYLE)]
+            pen = pg.mkPen(self.COLOR[ch], width=5, style=style)
+            # gaps (NaN) break the line instead of being bridged
             curve = self.plot_widget.plot(
-                self.time,
-                self.temp[i],
-                name=self.ch_dialogs[ch].name_text.text(),
+                name=self.ch_dialogs[unit, ch].name_text.text(),
                 pen=pen,
+                connect="finite",
             )
             self.curves.append(curve)
         self.plot_widget.showGrid(x=True, y=True, alpha=0.2)
-
-    def output_csv(self) -> None:
-        csv_file = join(self.save_dir, self.session_time + ".csv")
-        with open(csv_file, "w", newline="") as f:
-            ch_names = []
-            f.write("# Configurations\n")
-            f.write(f"#Dir {self.save_dir}\n")
-            f.write(f"#Samp {self.samp_int}\n")
-            f.write(f"#Therm {self.tc_cb.currentIndex()}\n")
-            for ch, dlg in enumerate(self.ch_dialogs):
-                if dlg:
-                    if ch in self.selected_ch:
-                        ch_names.append(dlg.name_text.text())
-                        f.write(f"#Ch {ch} ->{dlg.temp_text.text()} {ch_names[-1]}\n")
-                    else:
-                        f.write(
-                            f"#Ch {ch} /->{dlg.temp_text.text()} {dlg.name_text.text()}\n"
-                        )
-            f.write(f"#Mail {' '.join(self.mail_addresses)}\n")
-            f.write("#\n")
-            f.write("#" * 30 + "\n")
-            writer = csv.writer(f)
-            writer.writerow(["Elapsed time (s)"] + ch_names)
-            for row in zip(self.time, *self.temp):
-                writer.writerow(row)
+        self.display.mark_dirty()
+
+    def refresh_curves(self, curves=None) -> None:
+        # only draw about one min/max pair per horizontal pixel of the view, from
+        # the minute/hour buckets once a pixel spans more than a minute
+        vb = self.plot_widget.getViewBox()
+        if vb.autoRangeEnabled()[0] and len(self.store):
+            x0, x1 = self.store.time[0], self.store.time[-1]
+        else:
+            x0, x1 = vb.viewRange()[0]
+        width = max(int(vb.width()), 100)
+        trends = self.aggregates and self.aggregates.view(x0, x1, width)
+        if trends:
+            time_data, temp_data = trends
+        else:
+            time_data, temp_data = self.pyramid.view(x0, x1, width)
+        for i in range(len(self.curves)) if curves is None else curves:
+            self.curves[i].setData(time_data, temp_data[i])
+
+    def snapshot(self):
+        # attachment image of the whole session, shared by mails sent together
+        names = [self.ch_dialogs[ch].name_text.text() for ch in self.selected_ch]
+        colors = [self.COLOR[ch] for _, ch in self.selected_ch]
+        return self.snapshots.capture(self.pyramid, names, colors)
+
+    def view_changed(self) -> None:
+        # zooming or panning, auto-ranged views are refreshed by update_plot
+        if self.pyramid and not self.plot_widget.getViewBox().autoRangeEnabled()[0]:
+            self.display.mark_dirty()
+
+    def config(self):
+        config = {
+            "save_dir": self.save_dir,
+            "samp_int": self.samp_int,
+            "mode": self.acq_mode,
+            "therm": self.tc_cb.currentIndex(),
+            "channels": {},
+            "mail": self.mail_addresses,
+        }
+        for ch, dlg in self.ch_dialogs.items():
+            config["channels"][ch] = {
+                "on": ch in self.selected_ch,
+                "notify": dlg.temp_text.text(),
+                "name": dlg.name_text.text(),
+            }
+            for key, text in dlg.rule_texts.items():
+                config["channels"][ch][key] = text.text()
+        return config
+
+    def config_header(self):
+        config = self.config()
+        return format_header(config), channel_names(config)
+
+    def open_session(self) -> None:
+        # the session is journaled from the start so a crash keeps the data so far
+        ext = BINARY_EXT if self.binary_act.isChecked() else ".csv"
+        csv_file = join(self.save_dir, self.session_time + ext)
+        if self.rotate_hours or self.rotate_mb:
+            self.writer = RotatingSessionWriter(
+                csv_file,
+                *self.config_header(),
+                max_seconds=self.rotate_hours * 3600 or None,
+                max_bytes=self.rotate_mb * 2**20 or None,
+                compress=self.compress,
+            )
+            csv_file = self.writer.path
+        elif self.binary_act.isChecked():
+            self.writer = BinarySessionWriter(csv_file, *self.config_header())
+        else:
+            self.writer = SessionWriter(csv_file, *self.config_header())
 
         with open(join(self.FILE_PATH, "last_opened.txt"), "w") as f:
             f.write(csv_file)
+        self.aggregates = Aggregates(
+            len(self.selected_ch),
+            join(self.save_dir, self.session_time),
+            *self.config_header(),
+        )
+
+        if self.publish:
+            try:
+                header, ch_names = self.config_header()
+                self.publisher = Publisher(
+                    header=header, ch_names=ch_names, **self.publish
+                )
+            except OSError as e:
+                print(f"Not publishing: {e}")
 
     def enabled_controls(self, enabled) -> None:
         for control in self.CONTROLS:
             control.setEnabled(enabled)
 
     def update_plot(self) -> None:
-        self.time = self.time + [t / 1000 for t in self.time_buffer[: self.BUFFER_LEN]]
-        is_minute = round(self.time[-1]) % 60 == 0
-        for i, ch in enumerate(self.selected_ch):
-            tc08.usb_tc08_get_temp(
-                self.DEV_HANDLE,  # handle
-                ctypes.byref(self.temp_buffer[ch]),  # temp_buffer
-                ctypes.byref(self.time_buffer),  # times_ms_buffer
-                self.BUFFER_LEN,  # buffer_length
-                ctypes.byref(self.overflow),  # overflow
-                ch,  # channel
-                tc08.USBTC08_UNITS["USBTC08_UNITS_CENTIGRADE"],  # units
-                1,  # fill_missing
-            )
-            cur_temp = self.temp_buffer[ch][: self.BUFFER_LEN]
-            if self.notify_at[ch] and max(cur_temp) >= self.notify_at[ch]:
-                self.notify(ch, self.notify_at[ch])
-                self.notify_at[ch] = None
-            self.temp[i] = self.temp[i] + cur_temp
-            self.curves[i].setData(self.time, self.temp[i])
-
-            if is_minute:
-                self.check_rapid_change(ch, self.temp[i])
-
-    def check_rapid_change(self, channel, temperature) -> None:
-        # warn when more than 1 deg celsius per minute
-        prev_idx = 60 * 1000 // self.timer.interval()
-        if len(temperature) < prev_idx:
+        self.alert(self.notifier.poll(time.monotonic()))
+        time_block, temp_block = self.worker.drain()
+        if time_block is None:
             return
-
-        diff = temperature[-1] - temperature[-prev_idx]
-        if abs(diff) > 1:
-            ch_name = self.ch_dialogs[channel].name_text.text()
-            runnable = MailingThread(
-                self.mailer,
-                self.plot_widget,
-                f"{ch_name} temperature change by {diff}\u2103 in a minute",
-            )
+        t0 = time.perf_counter()
+        self.store.append(time_block, temp_block)
+        self.aggregates.update(time_block, temp_block)
+        self.writer.write(time_block, temp_block)
+        if self.publisher:
+            self.publisher.publish(time_block, temp_block)
+        self.pyramid.update()
+
+        for alert in self.alerts.process(time_block, temp_block):
+            print(alert.msg)
+            self.notifier.add(alert, time.monotonic())
+        self.display.mark_dirty()
+        CONSUME_SECONDS.observe(time.perf_counter() - t0)
+
+    def update_status(self) -> None:
+        # keeping-up indicators, the full set is served by the metrics endpoint
+        now_s, samples = time.monotonic(), SAMPLES.total()
+        last_s, last_samples = self.last_samples
+        self.last_samples = (now_s, samples)
+        parts = [f"{(samples - last_samples) / (now_s - last_s):.1f} samples/s"]
+        for label, histogram in [
+            ("lag", BLOCK_LATENCY),
+            ("tick", CONSUME_SECONDS),
+            ("plot", PLOT_SECONDS),
+        ]:
+            latest = histogram.latest()
+            if latest is not None:
+                parts.append(f"{label} {latest * 1000:.1f} ms")
+        parts.append(f"gaps {GAPS.total():g}")
+        parts.append(f"overflows {OVERFLOWS.total():g}")
+        parts.append(f"mail queue {MAIL_QUEUE.value():g}")
+        parts.append(f"{SESSION_BYTES.total() / 2**20:.1f} MB written")
+        self.metrics_label.setText(" | ".join(parts))
+
+    def alert(self, msg) -> None:
+        # one mail and plot snapshot for all alerts merged by the notifier
+        if msg and self.mail_addresses:
+            runnable = MailingThread(self.mailer, self.snapshot(), msg)
             self.pool.start(runnable)
 
-    def notify(self, channel, temperature) -> None:
-        ch_name = self.ch_dialogs[channel].name_text.text()
-        runnable = MailingThread(
-            self.mailer,
-            self.plot_widget,
-            f"{ch_name} reached {temperature}\u2103",
-        )
-        self.pool.start(runnable)
-
-    def fake_temperature_data(self, time) -> float:
-        return np.random.normal() * 3 + 150 - np.exp((290 - time) / 60)
-
 
 class ChannelDialog(QtWidgets.QDialog):
     def __init__(self, channel, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
         self.setWindowFlags(self.windowFlags() & ~QtCore.Qt.WindowContextHelpButtonHint)
 
-        self.setWindowTitle(f"Channel {channel} Settings")
+        label = channel_label(channel)
+        self.setWindowTitle(f"Channel {label} Settings")
 
         btns = QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel
         self.btn_box = QtWidgets.QDialogButtonBox(btns)
@@ -492,7 +756,7 @@ class ChannelDialog(QtWidgets.QDialog):
 
         name_layout = QtWidgets.QHBoxLayout()
         name_label = QtWidgets.QLabel("Name:")
-        self.name_text = QtWidgets.QLineEdit(f"Ch. {channel}")
+        self.name_text = QtWidgets.QLineEdit(f"Ch. {label}")
         name_layout.addWidget(name_label)
         name_layout.addWidget(self.name_text)
 
@@ -506,47 +770,194 @@ class ChannelDialog(QtWidgets.QDialog):
         validator.setRange(0, np.inf)
         self.temp_text.setValidator(validator)
 
+        # alert rules, a blank limit turns the rule off
+        self.rule_texts = {}
+        rule_layouts = []
+        for row in [
+            [("hyst", "Hysteresis (\u2103):", "notify once")],
+            [("rate", "Max change (\u2103):", "off"), ("rate_win", "in (s):", "")],
+            [
+                ("dev", "Max deviation from average (\u2103):", "off"),
+                ("dev_win", "over (s):", ""),
+            ],
+        ]:
+            row_layout = QtWidgets.QHBoxLayout()
+            for key, label, placeholder in row:
+                text = QtWidgets.QLineEdit(RULE_DEFAULTS[key])
+                text.setPlaceholderText(placeholder)
+                text.setValidator(validator)
+                row_layout.addWidget(QtWidgets.QLabel(label))
+                row_layout.addWidget(text)
+                self.rule_texts[key] = text
+            rule_layouts.append(row_layout)
+
         layout = QtWidgets.QVBoxLayout()
         self.setLayout(layout)
         layout.addLayout(name_layout)
         layout.addLayout(temp_layout)
+        for row_layout in rule_layouts:
+            layout.addLayout(row_layout)
         layout.addSpacing(50)
         layout.addStretch(1)
         layout.addWidget(self.btn_box)
 
 
+class SessionDialog(QtWidgets.QDialog):
+    # saved sessions as listed by a Catalog, filtered by text, to open whole or
+    # only between two elapsed times
+    COLUMNS = [
+        "Session",
+        "Channels",
+        "Duration",
+        "Rows",
+        "Min (\u2103)",
+        "Max (\u2103)",
+    ]
+
+    def __init__(self, catalog, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.setWindowFlags(self.windowFlags() & ~QtCore.Qt.WindowContextHelpButtonHint)
+        self.setWindowTitle("Sessions")
+        self.resize(800, 500)
+        self.catalog = catalog
+        self.keys = []
+
+        self.filter_text = QtWidgets.QLineEdit()
+        self.filter_text.setPlaceholderText("Filter by name, channel or header text")
+        self.filter_text.textChanged.connect(self.update_table)
+
+        self.table = QtWidgets.QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QtWidgets.QAbstractItemView.SingleSelection)
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        self.table.verticalHeader().hide()
+        self.table.doubleClicked.connect(self.accept)
+
+        # time window, blank for the start/end of the session
+        window_layout = QtWidgets.QHBoxLayout()
+        validator = QtGui.QDoubleValidator()
+        self.window_texts = []
+        for label, placeholder in [("From (s):", "start"), ("to (s):", "end")]:
+            text = QtWidgets.QLineEdit()
+            text.setPlaceholderText(placeholder)
+            text.setValidator(validator)
+            window_layout.addWidget(QtWidgets.QLabel(label))
+            window_layout.addWidget(text)
+            self.window_texts.append(text)
+
+        btns = QtWidgets.QDialogButtonBox.Open | QtWidgets.QDialogButtonBox.Cancel
+        self.btn_box = QtWidgets.QDialogButtonBox(btns)
+        self.btn_box.accepted.connect(self.accept)
+        self.btn_box.rejected.connect(self.reject)
+
+        layout = QtWidgets.QVBoxLayout()
+        self.setLayout(layout)
+        layout.addWidget(self.filter_text)
+        layout.addWidget(self.table, 1)
+        layout.addLayout(window_layout)
+        layout.addWidget(self.btn_box)
+        self.update_table()
+
+    def update_table(self) -> None:
+        self.keys = self.catalog.find(self.filter_text.text())
+        self.table.setRowCount(len(self.keys))
+        for row, key in enumerate(self.keys):
+            entry = self.catalog.sessions[key]
+            duration = (entry["end"] - entry["start"]) if entry["rows"] else 0
+            lo = [v for v in entry["min"] if v is not None]
+            hi = [v for v in entry["max"] if v is not None]
+            cells = [
+                entry["name"],
+                ", ".join(entry["ch_names"]),
+                f"{int(duration) // 3600}:{int(duration) % 3600 // 60:02d}:"
+                f"{int(duration) % 60:02d}",
+                f"{entry['rows']}",
+                f"{min(lo):.2f}" if lo else "",
+                f"{max(hi):.2f}" if hi else "",
+            ]
+            for col, cell in enumerate(cells):
+                self.table.setItem(row, col, QtWidgets.QTableWidgetItem(cell))
+        self.table.resizeColumnsToContents()
+        if self.keys:
+            self.table.selectRow(0)
+
+    def selected(self):
+        # (catalog key, t_range or None) of the session to open, None if none
+        rows = self.table.selectionModel().selectedRows()
+        if not rows:
+            return None
+        t_range = []
+        for text, default in zip(self.window_texts, (-np.inf, np.inf)):
+            try:
+                t_range.append(float(text.text()))
+            except ValueError:
+                t_range.append(default)
+        t_range = None if np.isinf(t_range).all() else tuple(t_range)
+        return self.keys[rows[0].row()], t_range
+
+
+class CatalogThread(QtCore.QThread):
+    def __init__(self, catalog, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.catalog = catalog
+
+    def run(self) -> None:
+        self.catalog.refresh()
+
+
 class MailingThread(QtCore.QRunnable):
-    def __init__(self, mailer, plot, msg, *args, **kwargs) -> None:
+    def __init__(self, mailer, snapshot, msg, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
         self.mailer = mailer
-        self.plot = plot
+        self.snapshot = snapshot
         self.msg = msg
 
     @QtCore.pyqtSlot()
     def run(self) -> None:
         self.mailer.mail_new()
-        if self.plot:
+        if self.snapshot:
             self.mail_compile()
         self.mailer.mail_body(self.msg)
         self.mailer.mail_send()
 
     def mail_compile(self) -> None:
-        exporter = ImageExporter(self.plot.plotItem)
-        f = QtCore.QBuffer()
-        f.open(QtCore.QBuffer.ReadWrite)
-        img = exporter.export(toBytes=True)
-        img.save(f, "PNG")
-        f.seek(0)
-        self.mailer.mail_attach(f.readAll(), f"{now()}.png")
-        f.close()
-
-
-def now() -> str:
-    return datetime.now().strftime("%Y%m%d-%H%M%S")
+        # rendered from the copied samples, never from the live plot widget
+        self.mailer.mail_attach(self.snapshot.png(), f"{now()}.png")
 
 
 if __name__ == "__main__":
-    app = QtWidgets.QApplication(sys.argv)
-    w = MainWindow()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--simulate",
+        nargs="?",
+        type=int,
+        const=1,
+        metavar="UNITS",
+        help="use simulated TC-08s, one unless UNITS is given",
+    )
+    parser.add_argument(
+        "--publish", help="stream sessions to subscribers at host:port or a socket path"
+    )
+    parser.add_argument("--publish-format", choices=FORMATS, default="line")
+    parser.add_argument("--publish-drop", choices=DROP_POLICIES, default="oldest")
+    parser.add_argument(
+        "--metrics-port", type=int, help="serve Prometheus metrics on localhost:PORT"
+    )
+    args, qt_args = parser.parse_known_args()
+    if args.metrics_port is not None:
+        MainWindow.metrics_port = args.metrics_port
+    if args.publish:
+        MainWindow.publish = {
+            "address": args.publish,
+            "fmt": args.publish_format,
+            "drop": args.publish_drop,
+        }
+    app = QtWidgets.QApplication(sys.argv[:1] + qt_args)
+    devices = None
+    if args.simulate:
+        devices = [SimulatedDevice() for _ in range(args.simulate)]
+    w = MainWindow(devices)
     w.show()
     sys.exit(app.exec())